@@ -16,6 +16,9 @@ The module jekyllalbum.py:
     
         - docpath: the full path to a folder that must contain the txt file as given by the "projFN" parameter
         - projFN: the name of an existing txt files that sequentially lists json parameter files to run
+        
+    From the command line both are given as the path to the txt file: python jekyllalbum.py path/to/projFN.txt,
+    see --help for the options to override the scheduler jobs and to profile a run with cProfile or tracemalloc.
     
     
     The individual parameter files (listed in "projFN") must have approximately 40 parameters 
@@ -31,8 +34,18 @@ The module jekyllalbum.py:
     
     - JekyllYaml: creates the markdown yaml header
     - FigClass: processes the listed images using ImageMagick
+        - with media "mode": "scan" the images are found in "srcfp" by include/exclude rules and ordered by capture time,
+          using an incrementally updated index instead of the "listfn" file
+        - DedupImageList: with "dedup" exact duplicates (sha1) and optionally near-duplicates (dHash within a
+          Hamming distance) are dropped from the image list before any rendering, hashes are cached on file stat
         - MagickConvertFull: convert images using ImageMagick
+            - JPEG sources are decoded at a reduced DCT scale close to the target size if "jpegdraft" is set
         - MagickConvertPage: reduced resolution images from MagickConvertFull if requested
+        - MagickConvertVariant: multi-format, multi-width in-page images for <picture>/srcset if "srcset" is set
+        - renditions already produced for any roll are taken from the shared rendition cache if "cache" is set
+        - images are processed concurrently by "scheduler" jobs, admitted under a memory budget estimated from the image headers
+        - GetImageMeta: exif metadata, one _meta_ json file per image or, with "metastore", one JSON Lines
+          or SQLite store per roll or site that is updated incrementally and can be queried (--query-meta)
     - WritePost: Write the makrdown ffor the Jekyll theme soSimple (v2).
             
 '''
@@ -45,13 +58,52 @@ import os
 
 import subprocess
 
+import shutil
+
+import hashlib
+
+import math
+
+import time
+
+import re
+
+import fnmatch
+
+import argparse
+
+import contextlib
+
+import sqlite3
+
+from urllib.request import pathname2url
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from collections import namedtuple
+
 # Third party imports
 
 import json
 
-from PIL import Image
+# PIL is imported by LoadPIL, only when images are processed
+
+Image = ImageChops = ImageStat = TAGS = None
 
-from PIL.ExifTags import TAGS
+def LoadPIL():
+    ''' Import PIL into the module namespace, deferred so that the command line and templates work without it
+    
+        Every function using PIL calls this first, TAGS is bound last so that
+        a thread never sees a partial import.
+    '''
+    
+    global Image, ImageChops, ImageStat, TAGS
+    
+    if TAGS is None:
+        
+        from PIL import Image, ImageChops, ImageStat
+        
+        from PIL.ExifTags import TAGS
 
 def JekyllAlbumJson():
     """ Create a template dictionary for parametising this script
@@ -66,7 +118,12 @@ def JekyllAlbumJson():
       "overwrite": True,
       "media": {
         "srcfp": "path/to/image/library",
+        "mode": "list",
         "listfn": "album.txt",
+        "include": ["*.jpg", "*.jpeg", "*.tif", "*.tiff", "*.png"],
+        "exclude": [".*", "*/.*"],
+        "recursive": True,
+        "indexfn": "jekyllalbum_index.json",
         "labelsfn": False,
         "magickfn": False
       },
@@ -82,7 +139,15 @@ def JekyllAlbumJson():
         "ydim": 0,
         "kind": "jpg",
         "quality": 70,
-        "suffix": "s"
+        "suffix": "s",
+        "srcset": {
+          "widths": [300, 600, 900],
+          "sizes": "(max-width: 600px) 100vw, 33vw",
+          "formats": {
+            "avif": {"quality": 50},
+            "webp": {"quality": 75}
+          }
+        }
       },
       "imagemagick": {
         "convert": {
@@ -91,6 +156,10 @@ def JekyllAlbumJson():
         "dissolve": 50,
         "alpha": 0,
         "emboss": False,
+        "bindir": "/usr/local/bin",
+        "jpegdraft": True,
+        "draftfactor": 1,
+        "draftcheck": False,
         "watermark": {
           "-font": "Arial",
           "-pointsize": "250",
@@ -135,6 +204,27 @@ def JekyllAlbumJson():
         "layout": "post",
         "categories": "existing category in you SoSimple structure",
         "dstfp": "destination folder of your local SoSimple setup"
+      },
+      "scheduler": {
+        "jobs": 4,
+        "memorymb": 4096,
+        "bytespersample": 2,
+        "magicklimit": True
+      },
+      "cache": {
+        "cachefp": False,
+        "maxgb": 20,
+        "link": True
+      },
+      "metastore": {
+        "format": "jsonl",
+        "scope": "roll"
+      },
+      "dedup": {
+        "exact": True,
+        "near": False,
+        "hamming": 6,
+        "hashfn": "jekyllalbum_hashes.json"
       }
     }
     
@@ -192,19 +282,21 @@ def JekyllYaml(pD):
 
 
         
-def GetImageMeta(srcImageFPN, dstJsonMetaFPN):
+def GetImageMeta(srcImageFPN, dstJsonMetaFPN=False):
     """ Retrieve image exifdata (metadata) using PIL, write to json file and return
         
         :param srcImageFPN: path to image source file
         :type srcImageFPN: str
         
-        :param dstJsonMetaFPN: path to destination metadata file
+        :param dstJsonMetaFPN: path to destination metadata file, False to only return the metadata
         :type dstJsonMetaFPN: str
         
         :returns: meatadata 
         :rtype: dict
     """
     
+    LoadPIL()
+    
     metaD = {}
     img = Image.open(srcImageFPN)
     
@@ -249,275 +341,2117 @@ def GetImageMeta(srcImageFPN, dstJsonMetaFPN):
             continue
             
         metaxD[tag] = metaD[tag]
+        
+    if dstJsonMetaFPN:
             
-    jsonF = open(dstJsonMetaFPN, "w")
-  
-    json.dump(metaxD, jsonF, indent = 2)
-  
-    jsonF.close()
+        jsonF = open(dstJsonMetaFPN, "w")
+      
+        json.dump(metaxD, jsonF, indent = 2)
+      
+        jsonF.close()
         
     return metaxD
+
+def ReadMetaStore(plan):
+    """ Read the records of a roll from the consolidated metadata store
     
-def MagickConvertPage(pD, dstFullFPN, dstPageFPN):
-    """ ImageMagick reduction of size and quality of the destination image to a smaller, in-page image
-        
-        :param pD: process parameters
-        :type pD: dict
+        :param plan: render plan
+        :type plan: RenderPlan
         
-        :param dstFullFPN: path to larger, existing (url-linked) destination image
-        :type dstFullFPN: str
-    
-        :param dstPageFPN: path to smaller (in-page) destination image
-        :type dstPageFPN: str
+        :returns: store state, oldD and newD hold records by image name, otherL the records of other rolls (JSON Lines)
+        :rtype: dict
     """
     
-    #Here is the conversion
-    if int(pD['inpageimages']['xdim']) and int(pD['inpageimages']['ydim']):
+    metaStoreD = {'oldD': {}, 'newD': {}, 'otherL': []}
     
-        resize = '%sx%s' %(pD['inpageimages']['xdim'], pD['inpageimages']['ydim'])
+    if not os.path.isfile(plan.metaStoreFPN):
         
-    elif int(pD['inpageimages']['xdim']):
+        return metaStoreD
     
-        resize = '%sx' %(pD['inpageimages']['xdim'])
+    if plan.metaFormat == 'sqlite':
+        
+        conn = MetaStoreConnect(plan.metaStoreFPN)
         
-    elif int(pD['inpageimages']['ydim']):
+        try:
+            
+            for recordD in MetaStoreRows(conn, 'WHERE roll = ?', (plan.rollName,)):
+                
+                metaStoreD['oldD'][recordD['name']] = recordD
+                
+        finally:
+            
+            conn.close()
+            
+        return metaStoreD
     
-        resize = 'x%s' %(pD['inpageimages']['ydim'])
+    with open(plan.metaStoreFPN) as jsonlF:
         
-    else:
+        for line in jsonlF:
+            
+            if not line.strip():
+                
+                continue
+            
+            recordD = json.loads(line)
+            
+            if recordD['roll'] == plan.rollName:
+                
+                metaStoreD['oldD'][recordD['name']] = recordD
+                
+            else:
+                
+                metaStoreD['otherL'].append(line.rstrip('\n'))
+                
+    return metaStoreD
+
+def StoredImageMeta(plan, srcImageFPN, baseName, metaStoreD):
+    """ Metadata of an image from the store, read from the image only if it is new or changed
     
-        resize = False
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageFPN: path to image source file
+        :type srcImageFPN: str
+        
+        :param baseName: image name in the roll
+        :type baseName: str
         
-    quality = str(pD['inpageimages']['quality'])
+        :param metaStoreD: store state from ReadMetaStore, the record is put in newD
+        :type metaStoreD: dict
+        
+        :returns: metadata
+        :rtype: dict
+    """
     
-    cmdL = ['/usr/local/bin/convert', '-resize', resize, '-quality', quality, dstFullFPN, dstPageFPN]
+    st = os.stat(srcImageFPN)
     
-    subprocess.run(cmdL)
-
-def MagickConvertFull(pD, srcImageFPN, dstFullFPN, tempFPN):
-    """ Process image source using ImageMAgick and save to destination path(s)
+    recordD = metaStoreD['oldD'].get(baseName)
     
-        :param pD: process parameters
-        :type pD: dict
+    if recordD is None or (recordD['src'], recordD['size'], recordD['mtime']) != (srcImageFPN, st.st_size, st.st_mtime):
         
-        :param srcImageFPN: path to the source image
-        :type srcImageFPN: str
+        metaD = GetImageMeta(srcImageFPN)
         
-        :param dstFullFPN: path to larger (url-linked) destination image
-        :type dstFullFPN: str
+        camera = ' '.join([str(metaD[tag]) for tag in ('Make', 'Model') if tag in metaD])
+        
+        recordD = {'roll': plan.rollName, 'name': baseName, 'src': srcImageFPN, 
+                   'size': st.st_size, 'mtime': st.st_mtime, 
+                   'datetime': str(metaD.get('DateTimeOriginal') or metaD.get('DateTime') or ''), 
+                   'camera': camera, 'exif': metaD}
+        
+    metaStoreD['newD'][baseName] = recordD
     
-        :param tempFPN: path to temporary image file
-        :type tempFPN: str
+    return recordD['exif']
+
+def MetaStoreConnect(storeFPN, readOnly=False):
+    """ Open a SQLite metadata store, creating the table and its indexes if missing
+    
+        :param storeFPN: path to the store
+        :type storeFPN: str
+        
+        :param readOnly: open an existing store for queries, nothing is created
+        :type readOnly: bool
+        
+        :returns: connection
+        :rtype: sqlite3.Connection
     """
-    #Here is the conversion
-    if int(pD['urlimages']['xdim']) and int(pD['urlimages']['ydim']):
     
-        resize = '%sx%s' %(pD['urlimages']['xdim'], pD['urlimages']['ydim'])
+    if readOnly:
         
-    elif int(pD['urlimages']['xdim']):
+        return sqlite3.connect('file:%s?mode=ro' %(pathname2url(os.path.abspath(storeFPN))), uri = True)
+    
+    conn = sqlite3.connect(storeFPN)
+    
+    conn.execute('CREATE TABLE IF NOT EXISTS imagemeta (roll TEXT, name TEXT, src TEXT, size INTEGER, mtime REAL, '
+                 'datetime TEXT, camera TEXT, exif TEXT, PRIMARY KEY (roll, name))')
+    
+    conn.execute('CREATE INDEX IF NOT EXISTS imagemeta_datetime ON imagemeta (datetime)')
+    
+    conn.execute('CREATE INDEX IF NOT EXISTS imagemeta_camera ON imagemeta (camera)')
     
-        resize = '%sx' %(pD['urlimages']['xdim'])
+    return conn
+
+def MetaStoreRows(conn, whereSQL='', argL=()):
+    """ Records of a SQLite metadata store
+    
+        :param conn: connection
+        :type conn: sqlite3.Connection
+        
+        :param whereSQL: WHERE clause, with ? placeholders
+        :type whereSQL: str
+        
+        :param argL: values for the placeholders
+        :type argL: tuple
         
-    elif int(pD['urlimages']['ydim']):
+        :returns: records
+        :rtype: list
+    """
+    
+    keyL = ['roll', 'name', 'src', 'size', 'mtime', 'datetime', 'camera', 'exif']
+    
+    recordL = []
     
-        resize = 'x%s' %(pD['urlimages']['ydim'])
+    for row in conn.execute('SELECT %s FROM imagemeta %s ORDER BY datetime, roll, name' %(', '.join(keyL), whereSQL), argL):
         
-    else:
+        recordD = dict(zip(keyL, row))
+        
+        recordD['exif'] = json.loads(recordD['exif'])
+        
+        recordL.append(recordD)
+        
+    return recordL
+
+def WriteMetaStore(plan, metaStoreD):
+    """ Write the records of a roll to the consolidated metadata store, if any changed
     
-        resize = False
+        Images no longer in the roll are dropped from the store.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
         
-    quality = str(pD['urlimages']['quality'])
+        :param metaStoreD: store state from ReadMetaStore, after StoredImageMeta for all images
+        :type metaStoreD: dict
+    """
+    
+    oldD, newD = metaStoreD['oldD'], metaStoreD['newD']
+    
+    if newD == oldD:
         
-    if pD['imagemagick']:
+        return
+    
+    if plan.metaFormat == 'sqlite':
         
-        convertCmd = []
+        conn = MetaStoreConnect(plan.metaStoreFPN)
         
-        for k,v in pD['imagemagick']['convert'].items():
-            convertCmd.append(k)
-            if v:
-                convertCmd.append( str(v) )
+        try:
+            
+            with conn:
+                
+                conn.executemany('DELETE FROM imagemeta WHERE roll = ? AND name = ?', 
+                                 [(plan.rollName, name) for name in oldD if name not in newD])
+                
+                conn.executemany('INSERT OR REPLACE INTO imagemeta VALUES (?, ?, ?, ?, ?, ?, ?, ?)', 
+                                 [(r['roll'], r['name'], r['src'], r['size'], r['mtime'], r['datetime'], r['camera'], json.dumps(r['exif'])) 
+                                  for name, r in newD.items() if oldD.get(name) != r])
+                
+        finally:
+            
+            conn.close()
+            
+        return
     
-        convertCmd = ','.join(convertCmd)
+    with open(plan.metaStoreFPN+'.tmp', 'w') as jsonlF:
+        
+        for line in metaStoreD['otherL']:
+            
+            jsonlF.write(line + '\n')
+            
+        for name in sorted(newD):
+            
+            jsonlF.write(json.dumps(newD[name]) + '\n')
+            
+    os.replace(plan.metaStoreFPN+'.tmp', plan.metaStoreFPN)
 
-    else:
+def QueryImageMeta(storeFPN, roll=False, dateFrom=False, dateTo=False, camera=False):
+    """ Query a JSON Lines (.jsonl) or SQLite metadata store, the store is only read
     
-        convertCmd = False
+        :param storeFPN: path to the store
+        :type storeFPN: str
         
-    if resize: 
+        :param roll: roll name
+        :type roll: str
         
-        if convertCmd:
-            
-            cmdL = ['/usr/local/bin/convert', '-resize', resize, convertCmd, '-quality', quality, srcImageFPN, dstFullFPN]
+        :param dateFrom: first capture date, as YYYYMMDD or a prefix of it
+        :type dateFrom: str
         
-        else:
-            cmdL = ['/usr/local/bin/convert', '-resize', resize, '-quality', quality, srcImageFPN, dstFullFPN]
+        :param dateTo: last capture date, as YYYYMMDD or a prefix of it
+        :type dateTo: str
+        
+        :param camera: text in the camera make and model, case insensitive
+        :type camera: str
+        
+        :returns: matching records ordered by capture time
+        :rtype: list
+    """
     
-    else: 
-        if convertCmd:
-            
-            cmdL = ['/usr/local/bin/convert',  convertCmd, '-quality', quality, srcImageFPN, dstFullFPN]
+    def Digits(text):
         
-        else:
-            cmdL = ['/usr/local/bin/convert',  '-quality', quality, srcImageFPN, dstFullFPN]
-
-    subprocess.run(cmdL)
+        return re.sub(r'\D', '', text or '')
+    
+    dateFrom, dateTo = Digits(dateFrom), Digits(dateTo)
     
-    if pD['imagemagick']['dissolve']:
+    if not os.path.isfile(storeFPN):
+        
+        sys.exit('EXITING, metadata store missing: %s' %(storeFPN))
+        
+    if storeFPN.endswith('.jsonl'):
+        
+        recordL = []
+        
+        try:
             
-        # Resize the original images
-        cmdL = ['/usr/local/bin/convert', '-resize', resize, srcImageFPN, tempFPN]
+            with open(storeFPN) as jsonlF:
+                
+                for line in jsonlF:
+                    
+                    if line.strip():
+                        
+                        recordL.append(json.loads(line))
+                        
+            recordL.sort(key = lambda r: (r['datetime'], r['roll'], r['name']))
+            
+        except (ValueError, KeyError, TypeError) as e:
+            
+            sys.exit('EXITING, not a JSON Lines metadata store: %s (%s)' %(storeFPN, e))
         
-        subprocess.run(cmdL)
+    else:
         
-        # composite the old and new image with the dissolve set
-        cmdL = ['/usr/local/bin/composite', '-dissolve', str(pD['imagemagick']['dissolve']),  tempFPN, dstFullFPN, dstFullFPN];
-    
-        subprocess.run(cmdL)
+        # the indexed columns narrow the query, the exact date rules are applied below
+        whereL = []
         
-    if pD['imagemagick']['alpha']:
+        argL = []
         
-        pass
-        # Not yet implemented
+        if roll:
+            
+            whereL.append('roll = ?')
+            
+            argL.append(roll)
+            
+        if camera:
+            
+            whereL.append('camera LIKE ?')
+            
+            argL.append('%%%s%%' %(camera))
+            
+        conn = MetaStoreConnect(storeFPN, True)
         
-    if pD['imagemagick']['emboss']:
+        try:
+            
+            recordL = MetaStoreRows(conn, 'WHERE %s' %(' AND '.join(whereL)) if whereL else '', tuple(argL))
+            
+        except sqlite3.DatabaseError as e:
+            
+            sys.exit('EXITING, not a SQLite metadata store: %s (%s)' %(storeFPN, e))
+            
+        finally:
+            
+            conn.close()
+            
+    matchL = []
+    
+    for recordD in recordL:
         
-        img = Image.open(dstFullFPN)
-  
-        # get width and height
-        w = img.width
+        date = Digits(recordD['datetime'])
         
-        h = img.height
-
-        cmdL = ['/usr/local/bin/convert', '-size', '%sx%s' %(w,h), 'xc:none',]
+        if roll and recordD['roll'] != roll:
+            
+            continue
         
-        for k,v in pD['imagemagick']['watermark'].items():
-
-            cmdL.append( k )
-            cmdL.append( v )
+        if camera and camera.lower() not in recordD['camera'].lower():
             
-        cmdL.append( tempFPN )
-
-        subprocess.run(cmdL)
-         
-        # Composite the embossed text and the fixed image 
-        cmdL = ['/usr/local/bin/composite',  tempFPN, dstFullFPN, dstFullFPN];
+            continue
         
-        subprocess.run(cmdL)
+        if dateFrom and date[0:len(dateFrom)] < dateFrom:
+            
+            continue
         
-def FigClass(pD, jsonFPN):
-    """ Process figures (images, photos) using ImageMagick
+        if dateTo and (not date or date[0:len(dateTo)] > dateTo):
+            
+            continue
+        
+        matchL.append(recordD)
+        
+    return matchL
     
-        :param pD: parameters for creating jekyll album
-        :type pD: dict
+def RenditionKey(srcHash, *paramL):
+    """ Content-addressed key of a rendition from the source hash and the rendering parameters
+    
+        :param srcHash: hash of the source image content (or of the parent rendition key)
+        :type srcHash: str
         
-        :param jsonFPN: path to json parameter file
-        :type jsonFPN: str
+        :param paramL: parameter dictionaries that affect the rendition
+        :type paramL: dict
         
-        :return bodyL: markdown body text
-        :rtype bodyL: list
+        :returns: rendition key
+        :rtype: str
     """
     
-    srcFP, rollName = os.path.split(jsonFPN)
+    hasher = hashlib.sha1(srcHash.encode('utf-8'))
     
-    rollName = os.path.splitext(rollName)[0]
+    for param in paramL:
+        
+        hasher.update(json.dumps(param, sort_keys = True).encode('utf-8'))
     
-    bodyL = []
+    return hasher.hexdigest()
+
+def SourceHash(srcImageFPN, hashD):
+    """ Content hash of a source image, cached on path, size and modification time
     
-    heading1 = '#### %s' %(pD['content']['description'])
+        :param srcImageFPN: path to image source file
+        :type srcImageFPN: str
+        
+        :param hashD: source hash cache, updated in place
+        :type hashD: dict
+        
+        :returns: hex digest
+        :rtype: str
+    """
     
-    bodyL.append(heading1)
+    st = os.stat(srcImageFPN)
     
-    who = '%s %s' %( '**Who:**', ', '.join(pD['content']['persons']) )
+    stamp = [st.st_size, st.st_mtime]
     
-    bodyL.append(who)
+    if srcImageFPN in hashD and hashD[srcImageFPN][0:2] == stamp:
+        
+        return hashD[srcImageFPN][2]
     
-    where = '**Where :** %s (%s)' %( pD['metadata']['location'], pD['metadata']['country'])
+    hashD[srcImageFPN] = stamp + [FileSha1(srcImageFPN)]
     
-    bodyL.append(where)
+    return hashD[srcImageFPN][2]
+
+def FileSha1(srcFPN):
+    """ sha1 hex digest of a file
     
-    bodyL.append('Mouse over the images to highlight, click to see larger pop-up images.')
+        :param srcFPN: path to file
+        :type srcFPN: str
+        
+        :returns: hex digest
+        :rtype: str
+    """
+    
+    hasher = hashlib.sha1()
+    
+    with open(srcFPN, 'rb') as f:
         
-    if pD['publication']['figclass'] in ['1', 'single', 'none', 'None', 'NA', 'na']:
-        bodyL.append('<figure>')
+        for buf in iter(lambda: f.read(1 << 20), b''):
+            
+            hasher.update(buf)
+            
+    return hasher.hexdigest()
+
+def ReadSourceHashes(cachePD):
+    """ Read the cached source hashes of the rendition cache
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
         
-    elif pD['publication']['figclass'] == 'half':
-        bodyL.append("<figure class='half'>")
+        :returns: source hash cache
+        :rtype: dict
+    """
+    
+    hashFPN = os.path.join(cachePD['cachefp'], 'sourcehashes.json')
+    
+    if not os.path.isfile(hashFPN):
         
-    elif pD['publication']['figclass'] == 'third':
-        bodyL.append("<figure class='third'>")
+        return {}
+    
+    with open(hashFPN) as jsonF:
         
-    else:
-        sys.exit('unknown figclass')
+        return json.load(jsonF)
+
+def WriteSourceHashes(cachePD, hashD):
+    """ Write the cached source hashes of the rendition cache
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
         
-    # Create target folder
-    tarFP = pD['publication']['dstfp']
-            
-    photoFP = os.path.join(tarFP,'photos')
+        :param hashD: source hash cache
+        :type hashD: dict
+    """
+    
+    hashFPN = os.path.join(cachePD['cachefp'], 'sourcehashes.json')
+    
+    with open(hashFPN+'.tmp', 'w') as jsonF:
+        
+        json.dump(hashD, jsonF)
         
-    rollFP = os.path.join(photoFP,rollName)
+    os.replace(hashFPN+'.tmp', hashFPN)
+
+def ReadCacheUse(cachePD):
+    """ Read the last use time of each rendition in the cache
     
-    if not os.path.exists(rollFP):
-        os.makedirs(rollFP)
-            
-    # Get the list of images
-    listFPN = os.path.join(pD['media']['srcfp'], pD['media']['listfn'])
+        Last use is kept in the cache's own json rather than in the file times,
+        as cached renditions may be hardlinked to published images.
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
+        
+        :returns: last use as epoch seconds per cached file name
+        :rtype: dict
+    """
     
-    with open(listFPN) as file:
+    useFPN = os.path.join(cachePD['cachefp'], 'lastuse.json')
     
-        lines = file.readlines()
+    if not os.path.isfile(useFPN):
         
-        lines = [line.rstrip() for line in lines]
+        return {}
     
-    for file in lines:
-            
-        srcImageFPN = file
+    with open(useFPN) as jsonF:
         
-        FN = os.path.split(file)[1]
+        return json.load(jsonF)
+
+def WriteCacheUse(cachePD, useD):
+    """ Write the last use time of each rendition in the cache
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
         
-        dstFullFN = dstPageFN = '%s_%s_%s.%s' %(rollName, 
-                                              pD['urlimages']['suffix'], 
-                                              os.path.splitext(FN)[0], 
-                                              pD['urlimages']['kind'])
+        :param useD: last use per cached file name
+        :type useD: dict
+    """
+    
+    useFPN = os.path.join(cachePD['cachefp'], 'lastuse.json')
+    
+    with open(useFPN+'.tmp', 'w') as jsonF:
         
-        dstjsonMetaFN = '%s_%s_%s.json' %(rollName, 
-                                            'meta',
-                                              os.path.splitext(FN)[0] )
-  
+        json.dump(useD, jsonF)
         
-        dstFullFPN = dstPageFPN = os.path.join(rollFP,dstFullFN)
+    os.replace(useFPN+'.tmp', useFPN)
+
+def LinkOrCopy(srcFPN, dstFPN, link=True):
+    """ Hardlink a file, or copy it if linking is not possible
+    
+        :param srcFPN: path to existing file
+        :type srcFPN: str
         
-        dstjsonMetaFPN = os.path.join(rollFP,dstjsonMetaFN)
+        :param dstFPN: path to destination, replaced if it exists
+        :type dstFPN: str
         
-        # Get the image meta data
-        metaD = GetImageMeta(srcImageFPN,dstjsonMetaFPN)
+        :param link: try hardlinking before copying
+        :type link: bool
+    """
+    
+    if os.path.lexists(dstFPN):
         
-        tempPFN = os.path.join(rollFP,'temp.png')
+        os.remove(dstFPN)
         
-        if not os.path.isfile(dstFullFPN) or pD['overwrite']:
+    if link:
         
-            MagickConvertFull(pD,srcImageFPN, dstFullFPN,tempPFN)
-               
-        if pD['inpageimages'] != pD['urlimages']:
+        try:
             
-            dstPageFN = '%s_%s_%s.%s' %(rollName, 
-                                        pD['inpageimages']['suffix'],
-                                        os.path.splitext(FN)[0],
-                                        pD['inpageimages']['kind'])
+            os.link(srcFPN, dstFPN)
             
-            dstPageFPN = os.path.join(rollFP,dstPageFN)
-            
-            if not os.path.isfile(dstPageFPN) or pD['overwrite']:
+            return
+        
+        except OSError:
             
-                MagickConvertPage(pD, dstFullFPN, dstPageFPN)
-
-        bodyL.append('<a href="../../photos/%(fp)s/%(fullfn)s"><img src="../../photos/%(fp)s/%(qlfn)s" alt="image"></a>' %{'fp':rollName, 'fullfn':dstFullFN, 'qlfn':dstPageFN})       
-
-        #bodyL.append('<a href="../../photos/%(fp)s/%(jsonfn)s">%(meta)s</a>' %{'fp':rollName, 'jsonfn':dstjsonMetaFN, 'meta':metaD['DateTime']})       
+            # e.g. the cache is on another filesystem
+            pass
+        
+    shutil.copy2(srcFPN, dstFPN)
 
-    bodyL.append("<figcaption>%s</figcaption>" %(pD['content']['figcaption']))
+def CachedRenditionFPN(cachePD, key, kind):
+    """ Path to a rendition in the cache
     
-    bodyL.append("</figure>")  
-      
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
+        
+        :param key: rendition key
+        :type key: str
+        
+        :param kind: image file extension
+        :type kind: str
+        
+        :returns: path to cached rendition
+        :rtype: str
+    """
+    
+    return os.path.join(cachePD['cachefp'], key[0:2], '%s.%s' %(key, kind))
+
+def CacheFetch(cachePD, useD, key, kind, dstFPN):
+    """ Put a cached rendition at the destination path if there is one
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
+        
+        :param useD: last use per cached file name, updated in place
+        :type useD: dict
+        
+        :param key: rendition key
+        :type key: str
+        
+        :param kind: image file extension
+        :type kind: str
+        
+        :param dstFPN: path to destination image
+        :type dstFPN: str
+        
+        :returns: True if the rendition was found
+        :rtype: bool
+    """
+    
+    cachedFPN = CachedRenditionFPN(cachePD, key, kind)
+    
+    if not os.path.isfile(cachedFPN):
+        
+        return False
+    
+    LinkOrCopy(cachedFPN, dstFPN, cachePD.get('link', True))
+    
+    # neither the access time (noatime) nor the modification time (hardlinked
+    # to the published image) can mark last use
+    useD[os.path.basename(cachedFPN)] = time.time()
+    
+    return True
+
+def CacheStore(cachePD, useD, key, kind, dstFPN):
+    """ Add a newly rendered image to the cache
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
+        
+        :param useD: last use per cached file name, updated in place
+        :type useD: dict
+        
+        :param key: rendition key
+        :type key: str
+        
+        :param kind: image file extension
+        :type kind: str
+        
+        :param dstFPN: path to rendered image
+        :type dstFPN: str
+    """
+    
+    if not os.path.isfile(dstFPN):
+        
+        return
+    
+    cachedFPN = CachedRenditionFPN(cachePD, key, kind)
+    
+    if not os.path.exists(os.path.dirname(cachedFPN)):
+        
+        os.makedirs(os.path.dirname(cachedFPN))
+        
+    LinkOrCopy(dstFPN, cachedFPN, cachePD.get('link', True))
+    
+    useD[os.path.basename(cachedFPN)] = time.time()
+
+def CacheEvict(cachePD, useD):
+    """ Remove the least recently used renditions until the cache is within its size limit
+    
+        Renditions without a recorded use, e.g. cached by an earlier version, are
+        ranked by their modification time.
+    
+        :param cachePD: rendition cache parameters
+        :type cachePD: dict
+        
+        :param useD: last use per cached file name, evicted and missing files are dropped
+        :type useD: dict
+    """
+    
+    maxBytes = float(cachePD.get('maxgb', 20)) * 1024**3
+    
+    entryL = []
+    
+    totalBytes = 0
+    
+    for root, dirs, files in os.walk(cachePD['cachefp']):
+        
+        for file in files:
+            
+            if root == cachePD['cachefp']:
+                
+                # sourcehashes.json, lastuse.json and their temporary files
+                continue
+            
+            st = os.stat(os.path.join(root, file))
+            
+            entryL.append( (useD.get(file, st.st_mtime), st.st_size, os.path.join(root, file)) )
+            
+            totalBytes += st.st_size
+            
+    presentS = set(os.path.basename(cachedFPN) for lastUse, size, cachedFPN in entryL)
+    
+    for file in [file for file in useD if file not in presentS]:
+        
+        del useD[file]
+        
+    if totalBytes <= maxBytes:
+        
+        return
+    
+    entryL.sort()
+    
+    for lastUse, size, cachedFPN in entryL:
+        
+        if totalBytes <= maxBytes:
+            
+            break
+        
+        os.remove(cachedFPN)
+        
+        useD.pop(os.path.basename(cachedFPN), None)
+        
+        totalBytes -= size
+
+# Immutable, validated render plan compiled once per album json
+RenderPlan = namedtuple('RenderPlan', ['rollName', 'rollFP', 'tempFPN', 'listFPN', 'overwrite', 'figureTag',
+                                       'mediaMode', 'srcFP', 'includeRE', 'excludeRE', 'recursive', 'indexFPN',
+                                       'convertBin', 'compositeBin',
+                                       'fullDims', 'fullOptL', 'fullKind', 'fullFNPattern', 'fullKeyParamL',
+                                       'pageStep', 'pageDims', 'pageOptL', 'pageKind', 'pageFNPattern', 'pageKeyParamL',
+                                       'metaFNPattern', 'metaFormat', 'metaStoreFPN', 'variantL', 'srcsetSizes',
+                                       'dissolve', 'dissolveOptL', 'emboss', 'watermarkL',
+                                       'jpegdraft', 'draftfactor', 'draftcheck', 'cachePD',
+                                       'jobs', 'memoryBudget', 'bytesPerSample', 'magickLimit', 'limitL',
+                                       'dedupExact', 'dedupNear', 'dedupHamming', 'dedupFPN'])
+
+def ResizeGeometry(imgD, label, errorL):
+    """ ImageMagick resize geometry from xdim and ydim
+    
+        :param imgD: urlimages or inpageimages parameters
+        :type imgD: dict
+        
+        :param label: parameter group name for error messages
+        :type label: str
+        
+        :param errorL: validation errors, appended to
+        :type errorL: list
+        
+        :returns: target (xdim, ydim) and resize geometry, False if no resizing
+        :rtype: tuple
+    """
+    
+    try:
+        
+        xdim = int(imgD['xdim'])
+        
+        ydim = int(imgD['ydim'])
+        
+        int(imgD['quality'])
+        
+    except (KeyError, TypeError, ValueError):
+        
+        errorL.append('%s requires integer xdim, ydim and quality' %(label))
+        
+        return (0, 0), False
+    
+    if xdim and ydim:
+    
+        resize = '%sx%s' %(xdim, ydim)
+        
+    elif xdim:
+    
+        resize = '%sx' %(xdim)
+        
+    elif ydim:
+    
+        resize = 'x%s' %(ydim)
+        
+    else:
+    
+        resize = False
+        
+    return (xdim, ydim), resize
+
+def CompileRenderPlan(pD, jsonFPN):
+    """ Compile and validate the album parameters into a render plan, before any image is processed
+    
+        All configuration errors are collected and the script exits listing them.
+    
+        :param pD: parameters for creating jekyll album
+        :type pD: dict
+        
+        :param jsonFPN: path to json parameter file
+        :type jsonFPN: str
+        
+        :returns: render plan
+        :rtype: RenderPlan
+    """
+    
+    errorL = []
+    
+    def Escape(item):
+        
+        return str(item).replace('%', '%%')
+    
+    rollName = os.path.splitext(os.path.split(jsonFPN)[1])[0]
+    
+    figclass = pD['publication']['figclass']
+    
+    if figclass in ['1', 'single', 'none', 'None', 'NA', 'na']:
+        figureTag = '<figure>'
+        
+    elif figclass in ['half', 'third']:
+        figureTag = "<figure class='%s'>" %(figclass)
+        
+    else:
+        figureTag = False
+        
+        errorL.append('unknown figclass: %s' %(figclass))
+        
+    datetime = str(pD['metadata']['datetime'])
+    
+    if len(datetime) != 8 or not datetime.isdigit():
+        
+        errorL.append('metadata datetime must be YYYYMMDD: %s' %(datetime))
+    
+    mediaD = pD['media']
+    
+    mediaMode = mediaD.get('mode', 'list')
+    
+    listFPN = os.path.join(mediaD['srcfp'], mediaD['listfn']) if mediaD.get('listfn') else False
+    
+    includeRE = excludeRE = indexFPN = False
+    
+    if mediaMode == 'scan':
+        
+        if not os.path.isdir(mediaD['srcfp']):
+            
+            errorL.append('media srcfp missing: %s' %(mediaD['srcfp']))
+            
+        # glob rules on paths relative to srcfp, compiled into one case insensitive regex each
+        includeRE = re.compile('|'.join([fnmatch.translate(g) for g in mediaD.get('include', ['*'])]), re.IGNORECASE)
+        
+        if mediaD.get('exclude'):
+            
+            excludeRE = re.compile('|'.join([fnmatch.translate(g) for g in mediaD['exclude']]), re.IGNORECASE)
+            
+        indexFPN = os.path.join(mediaD['srcfp'], mediaD.get('indexfn', 'jekyllalbum_index.json'))
+        
+    elif mediaMode != 'list':
+        
+        errorL.append('unknown media mode: %s' %(mediaMode))
+    
+    elif not listFPN or not os.path.isfile(listFPN):
+        
+        errorL.append('image list file missing: %s' %(listFPN))
+    
+    magickD = pD['imagemagick'] or {}
+    
+    binFP = magickD.get('bindir', '/usr/local/bin')
+    
+    convertBin = os.path.join(binFP, 'convert')
+    
+    compositeBin = os.path.join(binFP, 'composite')
+    
+    if not os.access(convertBin, os.X_OK):
+        
+        errorL.append('ImageMagick convert missing: %s' %(convertBin))
+        
+    dissolve = str(magickD['dissolve']) if magickD.get('dissolve') else False
+    
+    emboss = bool(magickD.get('emboss'))
+    
+    if (dissolve or emboss) and not os.access(compositeBin, os.X_OK):
+        
+        errorL.append('ImageMagick composite missing: %s' %(compositeBin))
+        
+    # alpha is not yet implemented
+    
+    # url-linked (full) images
+    fullDims, fullResize = ResizeGeometry(pD['urlimages'], 'urlimages', errorL)
+    
+    resizeL = ['-resize', fullResize] if fullResize else []
+    
+    convertOptL = []
+    
+    for k,v in magickD.get('convert', {}).items():
+        
+        convertOptL.append(k)
+        
+        if v:
+            convertOptL.append( str(v) )
+            
+    fullOptL = tuple(resizeL + convertOptL + ['-quality', str(pD['urlimages']['quality'])])
+    
+    dissolveOptL = tuple(resizeL)
+    
+    watermarkL = []
+    
+    if emboss:
+        
+        for k,v in magickD['watermark'].items():
+            
+            watermarkL.extend( [k, v] )
+    
+    fullFNPattern = '%s_%s_%%s.%s' %(Escape(rollName), Escape(pD['urlimages']['suffix']), Escape(pD['urlimages']['kind']))
+    
+    # in-page images, derived from the full images
+    pageStep = pD['inpageimages'] != pD['urlimages']
+    
+    pageDims, pageResize = ResizeGeometry(pD['inpageimages'], 'inpageimages', errorL)
+    
+    pageOptL = tuple((['-resize', pageResize] if pageResize else []) + ['-quality', str(pD['inpageimages']['quality'])])
+    
+    if pageStep:
+        
+        pageFNPattern = '%s_%s_%%s.%s' %(Escape(rollName), Escape(pD['inpageimages']['suffix']), Escape(pD['inpageimages']['kind']))
+        
+    else:
+        
+        pageFNPattern = fullFNPattern
+        
+    # multi-format, multi-width in-page variants
+    variantL = []
+    
+    srcsetD = pD['inpageimages'].get('srcset') or {}
+    
+    if srcsetD.get('widths'):
+        
+        # modern formats first, the page image kind is the fallback; its own
+        # encoder settings in formats are kept, merged over the page quality
+        formatD = dict(srcsetD.get('formats', {}))
+        
+        fallbackD = {'quality': pD['inpageimages']['quality']}
+        
+        fallbackD.update(formatD.pop(pD['inpageimages']['kind'], None) or {})
+        
+        formatD[pD['inpageimages']['kind']] = fallbackD
+        
+        widthL = []
+        
+        for width in srcsetD['widths']:
+            
+            if not str(width).isdigit():
+                
+                errorL.append('srcset widths must be integers: %s' %(width))
+                
+                continue
+            
+            # variants are resized from the full image, which is never enlarged
+            if fullDims[0] and int(width) > fullDims[0]:
+                
+                width = fullDims[0]
+                
+            if int(width) not in widthL:
+                
+                widthL.append(int(width))
+                
+        for kind, encodeD in formatD.items():
+            
+            encodeOptL = []
+            
+            for k,v in encodeD.items():
+                
+                if k == 'quality':
+                    
+                    encodeOptL.extend( ['-quality', str(v)] )
+                    
+                else:
+                    
+                    encodeOptL.append(k)
+                    
+                    if v:
+                        encodeOptL.append( str(v) )
+                        
+            for width in widthL:
+                
+                variantFNPattern = '%s_%s_%%s_w%s.%s' %(Escape(rollName), Escape(pD['inpageimages']['suffix']), width, Escape(kind))
+                
+                variantL.append( (kind, width, tuple(encodeOptL), variantFNPattern, (kind, width, encodeD)) )
+                
+    cachePD = pD.get('cache') or {}
+    
+    if not cachePD.get('cachefp'):
+        
+        cachePD = False
+        
+    # without a scheduler the images are processed one by one, as before
+    schedulerD = pD.get('scheduler') or {}
+    
+    try:
+        
+        jobs = int(schedulerD.get('jobs', 1)) or os.cpu_count() or 1
+        
+        memoryBudget = int(float(schedulerD.get('memorymb', 4096)) * 1024**2)
+        
+        bytesPerSample = int(schedulerD.get('bytespersample', 2))
+        
+    except (TypeError, ValueError):
+        
+        errorL.append('scheduler requires numeric jobs, memorymb and bytespersample')
+        
+        jobs, memoryBudget, bytesPerSample = 1, 0, 2
+        
+    # without a metastore each image gets its own _meta_ json file, as before
+    metastoreD = pD.get('metastore') or {}
+    
+    metaFormat = metastoreD.get('format', 'sidecar')
+    
+    metaScope = metastoreD.get('scope', 'roll')
+    
+    if metaFormat not in ('sidecar', 'jsonl', 'sqlite'):
+        
+        errorL.append('unknown metastore format: %s' %(metaFormat))
+        
+    if metaScope not in ('roll', 'site'):
+        
+        errorL.append('unknown metastore scope: %s' %(metaScope))
+        
+    # without dedup every listed image is rendered, as before
+    dedupD = pD.get('dedup') or {}
+    
+    try:
+        
+        dedupHamming = int(dedupD.get('hamming', 6))
+        
+    except (TypeError, ValueError):
+        
+        dedupHamming = -1
+        
+    if not 0 <= dedupHamming <= 64:
+        
+        errorL.append('dedup hamming must be an integer from 0 to 64: %s' %(dedupD.get('hamming')))
+        
+    if errorL:
+        
+        sys.exit('EXITING, invalid album parameters in %s:\n    %s' %(jsonFPN, '\n    '.join(errorL)))
+        
+    rollFP = os.path.join(pD['publication']['dstfp'], 'photos', rollName)
+    
+    metaStoreFPN = False
+    
+    if metaFormat != 'sidecar':
+        
+        if metaScope == 'site':
+            
+            metaStoreFPN = os.path.join(pD['publication']['dstfp'], 'photos', 'jekyllalbum_meta.%s' %(metaFormat))
+            
+        else:
+            
+            metaStoreFPN = os.path.join(rollFP, '%s_meta.%s' %(rollName, metaFormat))
+    
+    return RenderPlan(rollName = rollName, 
+                      rollFP = rollFP,
+                      tempFPN = os.path.join(rollFP,'temp.png'),
+                      listFPN = listFPN,
+                      mediaMode = mediaMode,
+                      srcFP = mediaD['srcfp'],
+                      includeRE = includeRE,
+                      excludeRE = excludeRE,
+                      recursive = bool(mediaD.get('recursive', True)),
+                      indexFPN = indexFPN,
+                      overwrite = pD['overwrite'],
+                      figureTag = figureTag,
+                      convertBin = convertBin,
+                      compositeBin = compositeBin,
+                      fullDims = fullDims,
+                      fullOptL = fullOptL,
+                      fullKind = pD['urlimages']['kind'],
+                      fullFNPattern = fullFNPattern,
+                      fullKeyParamL = (pD['urlimages'], pD['imagemagick']),
+                      pageStep = pageStep,
+                      pageDims = pageDims,
+                      pageOptL = pageOptL,
+                      pageKind = pD['inpageimages']['kind'],
+                      pageFNPattern = pageFNPattern,
+                      pageKeyParamL = (pD['inpageimages'],),
+                      metaFNPattern = '%s_meta_%%s.json' %(Escape(rollName)),
+                      metaFormat = metaFormat,
+                      metaStoreFPN = metaStoreFPN,
+                      variantL = tuple(variantL),
+                      srcsetSizes = srcsetD.get('sizes', '100vw'),
+                      dissolve = dissolve,
+                      dissolveOptL = dissolveOptL,
+                      emboss = emboss,
+                      watermarkL = tuple(watermarkL),
+                      jpegdraft = bool(magickD.get('jpegdraft')),
+                      draftfactor = float(magickD.get('draftfactor', 1)),
+                      draftcheck = bool(magickD.get('draftcheck')),
+                      cachePD = cachePD,
+                      jobs = jobs,
+                      memoryBudget = memoryBudget,
+                      bytesPerSample = bytesPerSample,
+                      magickLimit = bool(schedulerD.get('magicklimit', False)),
+                      limitL = (),
+                      dedupExact = bool(dedupD.get('exact')),
+                      dedupNear = bool(dedupD.get('near')),
+                      dedupHamming = dedupHamming,
+                      dedupFPN = os.path.join(mediaD['srcfp'], dedupD.get('hashfn', 'jekyllalbum_hashes.json')))
+
+def JpegSizeHint(plan, imageFPN, dims):
+    """ ImageMagick jpeg:size hint letting libjpeg decode a JPEG at a reduced DCT scale
+    
+        The decoder picks the smallest power-of-two scale that still gives at least
+        "draftfactor" times the target size, which cuts decoding time and peak memory
+        when large camera JPEGs are reduced to web sizes.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param imageFPN: path to the image to be decoded
+        :type imageFPN: str
+        
+        :param dims: target (xdim, ydim), 0 for a dimension set by the other
+        :type dims: tuple
+        
+        :returns: convert options to put before the input file, empty if not applicable
+        :rtype: list
+    """
+    
+    LoadPIL()
+    
+    xdim, ydim = dims
+    
+    if not plan.jpegdraft or (not xdim and not ydim):
+        
+        return []
+    
+    # only the header is read
+    with Image.open(imageFPN) as img:
+        
+        if img.format != 'JPEG':
+            
+            return []
+        
+        w, h = img.size
+        
+    if xdim and ydim:
+        
+        scale = min(xdim/w, ydim/h)
+        
+    elif xdim:
+        
+        scale = xdim/w
+        
+    else:
+        
+        scale = ydim/h
+        
+    scale *= plan.draftfactor
+    
+    if scale >= 1:
+        
+        return []
+    
+    return ['-define', 'jpeg:size=%sx%s' %(int(math.ceil(w*scale)), int(math.ceil(h*scale)))]
+
+def ImagePSNR(aFPN, bFPN):
+    """ Peak signal to noise ratio between two images of the same size
+    
+        :param aFPN: path to first image
+        :type aFPN: str
+        
+        :param bFPN: path to second image
+        :type bFPN: str
+        
+        :returns: PSNR in dB, inf for identical images
+        :rtype: float
+    """
+    
+    LoadPIL()
+    
+    with Image.open(aFPN) as a, Image.open(bFPN) as b:
+        
+        diff = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+        
+    rmsL = ImageStat.Stat(diff).rms
+    
+    rms = math.sqrt(sum([r*r for r in rmsL])/len(rmsL))
+    
+    if rms == 0:
+        
+        return float('inf')
+    
+    return 20*math.log10(255/rms)
+
+def DraftQualityCheck(plan, srcImageFPN, dstFullFPN, tempFPN):
+    """ Render an image also without reduced DCT decoding and report the difference
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageFPN: path to the source image
+        :type srcImageFPN: str
+        
+        :param dstFullFPN: path to existing url-linked image rendered with jpegdraft
+        :type dstFullFPN: str
+    
+        :param tempFPN: path to temporary image file
+        :type tempFPN: str
+        
+        :returns: PSNR in dB
+        :rtype: float
+    """
+    
+    refFPN = '%s_nodraft%s' %os.path.splitext(dstFullFPN)
+    
+    MagickConvertFull(plan._replace(jpegdraft = False), srcImageFPN, refFPN, tempFPN)
+    
+    psnr = ImagePSNR(dstFullFPN, refFPN)
+    
+    os.remove(refFPN)
+    
+    print ('jpegdraft check %s: PSNR %.1f dB' %(os.path.basename(srcImageFPN), psnr))
+    
+    if psnr < 40:
+        
+        print ('    WARNING: reduced DCT decoding visibly changes the output, consider a larger draftfactor')
+        
+    return psnr
+
+def MagickConvertPage(plan, dstFullFPN, dstPageFPN):
+    """ ImageMagick reduction of size and quality of the destination image to a smaller, in-page image
+        
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param dstFullFPN: path to larger, existing (url-linked) destination image
+        :type dstFullFPN: str
+    
+        :param dstPageFPN: path to smaller (in-page) destination image
+        :type dstPageFPN: str
+    """
+    
+    hintL = JpegSizeHint(plan, dstFullFPN, plan.pageDims)
+    
+    cmdL = [plan.convertBin] + list(plan.limitL) + hintL + list(plan.pageOptL) + [dstFullFPN, dstPageFPN]
+    
+    subprocess.run(cmdL)
+
+def MagickConvertFull(plan, srcImageFPN, dstFullFPN, tempFPN):
+    """ Process image source using ImageMAgick and save to destination path(s)
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageFPN: path to the source image
+        :type srcImageFPN: str
+        
+        :param dstFullFPN: path to larger (url-linked) destination image
+        :type dstFullFPN: str
+    
+        :param tempFPN: path to temporary image file
+        :type tempFPN: str
+    """
+    
+    LoadPIL()
+    
+    # Decode JPEG sources at a reduced scale, the option must precede the input file
+    hintL = JpegSizeHint(plan, srcImageFPN, plan.fullDims)
+    
+    #Here is the conversion
+    cmdL = [plan.convertBin] + list(plan.limitL) + hintL + list(plan.fullOptL) + [srcImageFPN, dstFullFPN]
+
+    subprocess.run(cmdL)
+    
+    if plan.dissolve:
+            
+        # Resize the original images
+        cmdL = [plan.convertBin] + list(plan.limitL) + hintL + list(plan.dissolveOptL) + [srcImageFPN, tempFPN]
+        
+        subprocess.run(cmdL)
+        
+        # composite the old and new image with the dissolve set
+        cmdL = [plan.compositeBin] + list(plan.limitL) + ['-dissolve', plan.dissolve,  tempFPN, dstFullFPN, dstFullFPN]
+    
+        subprocess.run(cmdL)
+        
+    if plan.emboss:
+        
+        img = Image.open(dstFullFPN)
+  
+        # get width and height
+        w = img.width
+        
+        h = img.height
+
+        cmdL = [plan.convertBin] + list(plan.limitL) + ['-size', '%sx%s' %(w,h), 'xc:none'] + list(plan.watermarkL) + [tempFPN]
+
+        subprocess.run(cmdL)
+         
+        # Composite the embossed text and the fixed image 
+        cmdL = [plan.compositeBin] + list(plan.limitL) + [tempFPN, dstFullFPN, dstFullFPN]
+        
+        subprocess.run(cmdL)
+        
+def MagickConvertVariant(plan, dstFullFPN, dstVariantFPN, width, encodeOptL):
+    """ ImageMagick reduction of the destination image to an in-page variant of given width and format
+        
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param dstFullFPN: path to larger, existing (url-linked) destination image
+        :type dstFullFPN: str
+    
+        :param dstVariantFPN: path to variant image, the extension sets the format
+        :type dstVariantFPN: str
+        
+        :param width: variant width, images are never enlarged
+        :type width: int
+        
+        :param encodeOptL: encoding options (quality and any further convert options)
+        :type encodeOptL: tuple
+    """
+    
+    cmdL = [plan.convertBin] + list(plan.limitL) + JpegSizeHint(plan, dstFullFPN, (width, 0)) + ['-resize', '%sx>' %(width)] + list(encodeOptL)
+    
+    cmdL.extend( [dstFullFPN, dstVariantFPN] )
+    
+    subprocess.run(cmdL)
+
+def CachedRender(cachePD, useD, key, kind, dstFPN, renderF, *argL):
+    """ Take a rendition from the cache or render it and add it to the cache
+    
+        :param cachePD: rendition cache parameters, False if no cache
+        :type cachePD: dict
+        
+        :param useD: last use per cached file name, None if no cache
+        :type useD: dict
+        
+        :param key: rendition key, False if no cache
+        :type key: str
+        
+        :param kind: image file extension
+        :type kind: str
+        
+        :param dstFPN: path to destination image
+        :type dstFPN: str
+        
+        :param renderF: function rendering dstFPN, called with argL
+        :type renderF: function
+    """
+    
+    if key and CacheFetch(cachePD, useD, key, kind, dstFPN):
+        
+        return
+    
+    if key and os.path.isfile(dstFPN):
+        
+        # never render into a file that may be hardlinked to the cache
+        os.remove(dstFPN)
+        
+    renderF(*argL)
+    
+    if key:
+        
+        CacheStore(cachePD, useD, key, kind, dstFPN)
+
+def PictureMarkup(rollName, dstFullFN, dstPageFN, variantL, sizes):
+    """ Linked <picture> element with one srcset <source> per modern format and the page image as fallback
+    
+        :param rollName: roll (and photo folder) name
+        :type rollName: str
+        
+        :param dstFullFN: file name of the url-linked image
+        :type dstFullFN: str
+        
+        :param dstPageFN: file name of the fallback in-page image
+        :type dstPageFN: str
+        
+        :param variantL: (format, width, file name) of all in-page variants
+        :type variantL: list
+        
+        :param sizes: html sizes attribute
+        :type sizes: str
+        
+        :returns: html markup
+        :rtype: str
+    """
+    
+    mimeD = {'avif': 'image/avif', 'webp': 'image/webp', 'jpg': 'image/jpeg', 
+             'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+    
+    urlFP = '../../photos/%s' %(rollName)
+    
+    srcsetL = []
+    
+    formatL = []
+    
+    for kind, width, variantFN in variantL:
+        
+        if kind not in formatL:
+            
+            formatL.append(kind)
+            
+        srcsetL.append( (kind, '%s/%s %sw' %(urlFP, variantFN, width)) )
+        
+    html = '<a href="%s/%s"><picture>' %(urlFP, dstFullFN)
+    
+    # the fallback format goes last, as srcset of the <img> itself
+    for kind in formatL[0:-1]:
+        
+        html += '<source type="%s" srcset="%s" sizes="%s">' %(mimeD.get(kind, 'image/%s' %(kind)), 
+                                                               ', '.join([item for k, item in srcsetL if k == kind]),
+                                                               sizes)
+    
+    html += '<img src="%s/%s" srcset="%s" sizes="%s" alt="image" loading="lazy"></picture></a>' %(urlFP, dstPageFN, 
+                                                                                                   ', '.join([item for k, item in srcsetL if k == formatL[-1]]),
+                                                                                                   sizes)
+    
+    return html
+
+def ImageDateDims(imageFPN, mtime):
+    """ Capture time and dimensions of an image, read from the header and exif only
+    
+        :param imageFPN: path to image file
+        :type imageFPN: str
+        
+        :param mtime: file modification time, used if there is no exif date
+        :type mtime: float
+        
+        :returns: capture time as 'YYYY:MM:DD HH:MM:SS', width and height
+        :rtype: tuple
+    """
+    
+    LoadPIL()
+    
+    dateTime = False
+    
+    w = h = 0
+    
+    try:
+        
+        with Image.open(imageFPN) as img:
+            
+            w, h = img.size
+            
+            exifdata = img.getexif()
+            
+            # DateTimeOriginal is in the Exif sub-IFD, DateTime in IFD0
+            if hasattr(exifdata, 'get_ifd'):
+                
+                dateTime = exifdata.get_ifd(0x8769).get(36867)
+                
+            if not dateTime:
+                
+                dateTime = exifdata.get(306)
+                
+    except (OSError, SyntaxError, ValueError) as e:
+        
+        print ('Cannot read image header', imageFPN, e)
+        
+    if isinstance(dateTime, bytes):
+        
+        dateTime = dateTime.decode(errors = 'ignore')
+        
+    if dateTime:
+        
+        dateTime = dateTime.rstrip('\x00').strip()
+        
+    if not dateTime:
+        
+        dateTime = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(mtime))
+        
+    return dateTime, w, h
+
+def ScanMediaIndex(plan):
+    """ Scan the source folder for images and return them ordered by capture time
+    
+        An index of (size, mtime, DateTimeOriginal, width, height) per relative path
+        is kept as json; on later scans only new or changed files are opened.
+        Output files are named from the file name alone, so two images with the
+        same base name in different folders (e.g. 100CANON/IMG_0001.JPG and
+        101CANON/IMG_0001.JPG) stop the run.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :returns: paths to the images, ordered by capture time and path
+        :rtype: list
+    """
+    
+    indexD = {}
+    
+    if os.path.isfile(plan.indexFPN):
+        
+        with open(plan.indexFPN) as jsonF:
+            
+            indexD = json.load(jsonF)
+            
+        if indexD.get('version') != 1:
+            
+            indexD = {}
+            
+    oldFileD = indexD.get('files', {})
+    
+    fileD = {}
+    
+    nNew = 0
+    
+    for root, dirs, files in os.walk(plan.srcFP, topdown = True):
+        
+        relRoot = os.path.relpath(root, plan.srcFP).replace(os.sep, '/')
+        
+        relRoot = '' if relRoot == '.' else relRoot + '/'
+        
+        # prune excluded folders before descending
+        if plan.excludeRE:
+            
+            dirs[:] = [d for d in dirs if not plan.excludeRE.match(relRoot + d) and not plan.excludeRE.match(relRoot + d + '/')]
+            
+        if not plan.recursive:
+            
+            dirs[:] = []
+            
+        for file in files:
+            
+            relFPN = relRoot + file
+            
+            if not plan.includeRE.match(relFPN):
+                
+                continue
+            
+            if plan.excludeRE and plan.excludeRE.match(relFPN):
+                
+                continue
+            
+            fileFPN = os.path.join(root, file)
+            
+            try:
+                
+                st = os.stat(fileFPN)
+                
+            except OSError as e:
+                
+                # e.g. a broken symlink
+                print ('Skipping unreadable image', fileFPN, e)
+                
+                continue
+            
+            entry = oldFileD.get(relFPN)
+            
+            if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime:
+                
+                dateTime, w, h = ImageDateDims(fileFPN, st.st_mtime)
+                
+                entry = [st.st_size, st.st_mtime, dateTime, w, h]
+                
+                nNew += 1
+                
+            fileD[relFPN] = entry
+            
+    if nNew or len(fileD) != len(oldFileD):
+        
+        with open(plan.indexFPN+'.tmp', 'w') as jsonF:
+            
+            json.dump({'version': 1, 'files': fileD}, jsonF)
+            
+        os.replace(plan.indexFPN+'.tmp', plan.indexFPN)
+        
+    print ('Indexed %s images in %s, %s new or changed' %(len(fileD), plan.srcFP, nNew))
+    
+    baseNameD = {}
+    
+    clashL = []
+    
+    for relFPN in sorted(fileD):
+        
+        baseName = os.path.splitext(relFPN.rsplit('/', 1)[-1])[0]
+        
+        if baseName in baseNameD:
+            
+            clashL.append('%s and %s' %(baseNameD[baseName], relFPN))
+            
+        else:
+            
+            baseNameD[baseName] = relFPN
+            
+    if clashL:
+        
+        sys.exit('EXITING, images in %s with the same name would overwrite each other, rename them or exclude one folder with the media "exclude" globs:\n    %s' %(plan.srcFP, '\n    '.join(clashL)))
+    
+    orderL = sorted(fileD, key = lambda relFPN: (fileD[relFPN][2], relFPN))
+    
+    return [os.path.join(plan.srcFP, *relFPN.split('/')) for relFPN in orderL]
+
+def AlbumImageList(plan):
+    """ Paths to the images of the album, from the list file or by scanning the source folder
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :returns: paths to the images
+        :rtype: list
+    """
+    
+    if plan.mediaMode == 'scan':
+        
+        return ScanMediaIndex(plan)
+    
+    with open(plan.listFPN) as file:
+    
+        lines = file.readlines()
+        
+    return [line.rstrip() for line in lines]
+
+def DHash(srcImageFPN):
+    """ 64 bit difference hash of an image, from the brightness gradients of a 9x8 grey thumbnail
+    
+        :param srcImageFPN: path to image source file
+        :type srcImageFPN: str
+        
+        :returns: hash as 16 hex digits
+        :rtype: str
+    """
+    
+    LoadPIL()
+    
+    with Image.open(srcImageFPN) as img:
+        
+        # JPEGs are decoded at a reduced DCT scale, other formats are shrunk by
+        # integer reduce steps before the final resampling, in place
+        img.thumbnail((64, 64), reducing_gap = 2.0)
+        
+        pixelL = list(img.convert('L').resize((9, 8)).getdata())
+        
+    value = 0
+    
+    for row in range(8):
+        
+        for col in range(8):
+            
+            value = (value << 1) | (pixelL[row*9+col] > pixelL[row*9+col+1])
+            
+    return '%016x' %(value)
+
+def ImageHashes(srcImageFPN, entry, needDHash):
+    """ Content and perceptual hash of an image, recalculated only if the file changed
+    
+        :param srcImageFPN: path to image source file
+        :type srcImageFPN: str
+        
+        :param entry: cached [size, mtime, sha1, dhash] or None
+        :type entry: list
+        
+        :param needDHash: calculate the dhash if it is not cached
+        :type needDHash: bool
+        
+        :returns: [size, mtime, sha1, dhash], dhash is '' if not calculated, or None if the file cannot be read
+        :rtype: list
+    """
+    
+    try:
+        
+        st = os.stat(srcImageFPN)
+        
+        stamp = [st.st_size, st.st_mtime]
+        
+        if not entry or entry[0:2] != stamp:
+            
+            entry = stamp + [FileSha1(srcImageFPN), '']
+            
+        if needDHash and not entry[3]:
+            
+            entry = entry[0:3] + [DHash(srcImageFPN)]
+            
+    except (OSError, SyntaxError, ValueError) as e:
+        
+        print ('Cannot hash image', srcImageFPN, e)
+        
+        return None
+        
+    return entry
+
+def DedupImageList(plan, srcImageL, sourceHashD=None):
+    """ Drop exact and near-duplicate images from the image list before rendering
+    
+        Images are kept in list order: a later image is dropped if it has the same
+        sha1 as a kept image or, with dedupNear, a dHash within dedupHamming bits of one.
+        Hashes are cached in dedupFPN on path, size and modification time. Images
+        that must be decoded for a dHash are admitted under the memory budget of
+        the plan by ScheduleJobs.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageL: paths to the images
+        :type srcImageL: list
+        
+        :param sourceHashD: source hash cache of the rendition cache, None if no cache; the
+            sha1s are shared with it both ways, so that each new image is read once
+        :type sourceHashD: dict
+        
+        :returns: paths to the images to render
+        :rtype: list
+    """
+    
+    hashD = {}
+    
+    if os.path.isfile(plan.dedupFPN):
+        
+        with open(plan.dedupFPN) as jsonF:
+            
+            hashD = json.load(jsonF)
+            
+    # only images without a current dHash are decoded, and need memory
+    seedL = []
+    
+    needL = []
+    
+    for srcImageFPN in srcImageL:
+        
+        entry = hashD.get(srcImageFPN)
+        
+        need = 0
+        
+        try:
+            
+            st = os.stat(srcImageFPN)
+            
+            stamp = [st.st_size, st.st_mtime]
+            
+            sourceEntry = sourceHashD.get(srcImageFPN) if sourceHashD is not None else None
+            
+            # the rendition cache may already hold the current sha1
+            if (not entry or entry[0:2] != stamp) and sourceEntry and sourceEntry[0:2] == stamp:
+                
+                entry = sourceEntry[0:3] + ['']
+                
+            if plan.dedupNear and (not entry or entry[0:2] != stamp or not entry[3]):
+                
+                need = EstimateJobMemory(plan, srcImageFPN)
+                
+        except OSError:
+            
+            # ImageHashes reports it
+            pass
+        
+        seedL.append(entry)
+        
+        needL.append(need)
+        
+    entryL = ScheduleJobs(plan, needL, 
+                          lambda executor, i, need: executor.submit(ImageHashes, srcImageL[i], seedL[i], plan.dedupNear))
+    
+    keptL = []
+    
+    shaD = {}
+    
+    nearL = []
+    
+    changed = False
+    
+    for srcImageFPN, entry in zip(srcImageL, entryL):
+        
+        if entry is None:
+            
+            keptL.append(srcImageFPN)
+            
+            continue
+        
+        if hashD.get(srcImageFPN) != entry:
+            
+            hashD[srcImageFPN] = entry
+            
+            changed = True
+            
+        if sourceHashD is not None:
+            
+            sourceHashD[srcImageFPN] = entry[0:3]
+            
+        if plan.dedupExact and entry[2] in shaD:
+            
+            print ('Skipping duplicate', srcImageFPN, 'of', shaD[entry[2]])
+            
+            continue
+        
+        if plan.dedupNear:
+            
+            value = int(entry[3], 16)
+            
+            nearFPN = False
+            
+            for keptFPN, keptValue in nearL:
+                
+                if bin(value ^ keptValue).count('1') <= plan.dedupHamming:
+                    
+                    nearFPN = keptFPN
+                    
+                    break
+                
+            if nearFPN:
+                
+                print ('Skipping near duplicate', srcImageFPN, 'of', nearFPN)
+                
+                continue
+            
+            nearL.append( (srcImageFPN, value) )
+            
+        shaD.setdefault(entry[2], srcImageFPN)
+        
+        keptL.append(srcImageFPN)
+        
+    if changed:
+        
+        with open(plan.dedupFPN+'.tmp', 'w') as jsonF:
+            
+            json.dump(hashD, jsonF)
+            
+        os.replace(plan.dedupFPN+'.tmp', plan.dedupFPN)
+        
+    if len(keptL) < len(srcImageL):
+        
+        print ('Deduplicated image list: %s of %s images kept' %(len(keptL), len(srcImageL)))
+        
+    return keptL
+
+def EstimateJobMemory(plan, srcImageFPN):
+    """ Estimate the peak memory of rendering an image from its header (width x height x bands)
+    
+        JPEG sources decoded at a reduced DCT scale are estimated at the decoded size.
+        The decoded and the resized image are both held, hence the factor 2.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageFPN: path to the source image
+        :type srcImageFPN: str
+        
+        :returns: estimated bytes
+        :rtype: int
+    """
+    
+    LoadPIL()
+    
+    try:
+        
+        # only the header is read
+        with Image.open(srcImageFPN) as img:
+            
+            w, h = img.size
+            
+            bands = len(img.getbands())
+            
+            isJpeg = img.format == 'JPEG'
+            
+    except (OSError, SyntaxError):
+        
+        # unknown images get the whole budget and run alone
+        return plan.memoryBudget
+    
+    xdim, ydim = plan.fullDims
+    
+    if plan.jpegdraft and isJpeg and (xdim or ydim):
+        
+        scale = min([d/s for d, s in ((xdim, w), (ydim, h)) if d]) * plan.draftfactor
+        
+        if scale < 1:
+            
+            # libjpeg scales in eighths
+            scale = max(1, math.ceil(scale*8))/8.0
+            
+            w, h = int(math.ceil(w*scale)), int(math.ceil(h*scale))
+            
+    return 2 * w * h * max(bands, 3) * plan.bytesPerSample
+
+def ScheduleJobs(plan, needL, submitF, keyL=None):
+    """ Run jobs concurrently, admitting them under the memory budget of the plan
+    
+        Pending jobs are started first-fit in list order: small jobs fill the
+        slots left by large ones, and a job larger than the whole budget runs
+        alone. Jobs with the same key run one after the other, in list order.
+    
+        :param plan: render plan, for jobs and memoryBudget
+        :type plan: RenderPlan
+        
+        :param needL: estimated bytes per job
+        :type needL: list
+        
+        :param submitF: called as submitF(executor, i, need) to submit job i, returns its future
+        :type submitF: function
+        
+        :param keyL: key per job, None if jobs may always run together
+        :type keyL: list
+        
+        :returns: result per job, in list order
+        :rtype: list
+    """
+    
+    resultL = [None]*len(needL)
+    
+    pendingL = list(enumerate(needL))
+    
+    runningD = {}
+    
+    busyS = set()
+    
+    used = 0
+    
+    with ThreadPoolExecutor(max_workers = plan.jobs) as executor:
+        
+        while pendingL or runningD:
+            
+            # admit jobs that fit, an oversized job only on an idle pool
+            for job in list(pendingL):
+                
+                if len(runningD) >= plan.jobs:
+                    
+                    break
+                
+                i, need = job
+                
+                if keyL is not None and keyL[i] in busyS:
+                    
+                    continue
+                
+                if used + need > plan.memoryBudget and runningD:
+                    
+                    continue
+                
+                runningD[submitF(executor, i, need)] = job
+                
+                if keyL is not None:
+                    
+                    busyS.add(keyL[i])
+                    
+                used += need
+                
+                pendingL.remove(job)
+                
+            doneS = wait(list(runningD), return_when = FIRST_COMPLETED)[0]
+            
+            for future in doneS:
+                
+                i, need = runningD.pop(future)
+                
+                if keyL is not None:
+                    
+                    busyS.discard(keyL[i])
+                    
+                used -= need
+                
+                resultL[i] = future.result()
+                
+    return resultL
+
+def RenderImage(plan, srcImageFPN, hashD, tempFPN, draftCheck=False, metaStoreD=None, useD=None):
+    """ Render all outputs of a single image according to the render plan
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageFPN: path to the source image
+        :type srcImageFPN: str
+        
+        :param hashD: source hash cache, None if no rendition cache
+        :type hashD: dict
+        
+        :param tempFPN: path to temporary image file, unique for the job
+        :type tempFPN: str
+        
+        :param draftCheck: compare the output with a full resolution decode
+        :type draftCheck: bool
+        
+        :param metaStoreD: metadata store state from ReadMetaStore, None for _meta_ json files
+        :type metaStoreD: dict
+        
+        :param useD: rendition cache last use from ReadCacheUse, None if no rendition cache
+        :type useD: dict
+        
+        :returns: markdown body line
+        :rtype: str
+    """
+    
+    rollFP = plan.rollFP
+    
+    rollName = plan.rollName
+    
+    cachePD = plan.cachePD
+    
+    FN = os.path.split(srcImageFPN)[1]
+    
+    baseName = os.path.splitext(FN)[0]
+    
+    dstFullFN = plan.fullFNPattern %(baseName)
+    
+    dstjsonMetaFN = plan.metaFNPattern %(baseName)
+    
+    dstFullFPN = os.path.join(rollFP,dstFullFN)
+    
+    dstjsonMetaFPN = os.path.join(rollFP,dstjsonMetaFN)
+    
+    # Get the image meta data
+    if metaStoreD is None:
+        
+        metaD = GetImageMeta(srcImageFPN,dstjsonMetaFPN)
+        
+    else:
+        
+        metaD = StoredImageMeta(plan, srcImageFPN, baseName, metaStoreD)
+    
+    fullKey = False
+    
+    if cachePD:
+        
+        fullKey = RenditionKey(SourceHash(srcImageFPN, hashD), *plan.fullKeyParamL)
+    
+    if not os.path.isfile(dstFullFPN) or plan.overwrite:
+        
+        CachedRender(cachePD, useD, fullKey, plan.fullKind, dstFullFPN, 
+                     MagickConvertFull, plan, srcImageFPN, dstFullFPN, tempFPN)
+        
+        if plan.jpegdraft and draftCheck:
+            
+            DraftQualityCheck(plan, srcImageFPN, dstFullFPN, tempFPN)
+            
+    dstPageFN = plan.pageFNPattern %(baseName)
+           
+    if plan.pageStep:
+        
+        dstPageFPN = os.path.join(rollFP,dstPageFN)
+        
+        if not os.path.isfile(dstPageFPN) or plan.overwrite:
+            
+            # the in-page image is derived from the full image
+            pageKey = RenditionKey(fullKey, *plan.pageKeyParamL) if fullKey else False
+            
+            CachedRender(cachePD, useD, pageKey, plan.pageKind, dstPageFPN, 
+                         MagickConvertPage, plan, dstFullFPN, dstPageFPN)
+            
+    if os.path.isfile(tempFPN):
+        
+        os.remove(tempFPN)
+            
+    if plan.variantL:
+        
+        variantL = []
+        
+        for kind, width, encodeOptL, variantFNPattern, keyParam in plan.variantL:
+            
+            variantFN = variantFNPattern %(baseName)
+            
+            variantFPN = os.path.join(rollFP,variantFN)
+            
+            if not os.path.isfile(variantFPN) or plan.overwrite:
+                
+                variantKey = RenditionKey(fullKey, *keyParam) if fullKey else False
+                
+                CachedRender(cachePD, useD, variantKey, kind, variantFPN, 
+                             MagickConvertVariant, plan, dstFullFPN, variantFPN, width, encodeOptL)
+                
+            variantL.append( (kind, width, variantFN) )
+                
+        return PictureMarkup(rollName, dstFullFN, dstPageFN, variantL, plan.srcsetSizes)
+        
+    #return '<a href="../../photos/%(fp)s/%(jsonfn)s">%(meta)s</a>' %{'fp':rollName, 'jsonfn':dstjsonMetaFN, 'meta':metaD['DateTime']}       
+
+    return '<a href="../../photos/%(fp)s/%(fullfn)s"><img src="../../photos/%(fp)s/%(qlfn)s" alt="image"></a>' %{'fp':rollName, 'fullfn':dstFullFN, 'qlfn':dstPageFN}
+
+def ScheduleRenderImages(plan, srcImageL, hashD, metaStoreD=None, useD=None):
+    """ Render images concurrently, admitting jobs under the memory budget of the plan
+    
+        Jobs are admitted by ScheduleJobs, images that render to the same output
+        file name run one after the other. With magicklimit, ImageMagick is given
+        -limit settings for the memory admitted to the job so that it spills to
+        its disk cache rather than exceeding it.
+    
+        :param plan: render plan
+        :type plan: RenderPlan
+        
+        :param srcImageL: paths to the source images
+        :type srcImageL: list
+        
+        :param hashD: source hash cache, None if no rendition cache
+        :type hashD: dict
+        
+        :param metaStoreD: metadata store state from ReadMetaStore, None for _meta_ json files
+        :type metaStoreD: dict
+        
+        :param useD: rendition cache last use from ReadCacheUse, None if no rendition cache
+        :type useD: dict
+        
+        :returns: markdown body line per image, in list order
+        :rtype: list
+    """
+    
+    tempBase = os.path.splitext(plan.tempFPN)[0]
+    
+    # output file name per image, as in RenderImage
+    outFNL = [plan.fullFNPattern %(os.path.splitext(os.path.split(fpn)[1])[0]) for fpn in srcImageL]
+    
+    def SubmitRender(executor, i, need):
+        
+        jobPlan = plan
+        
+        if plan.magickLimit:
+            
+            limit = min(need, plan.memoryBudget)
+            
+            jobPlan = plan._replace(limitL = ('-limit', 'memory', '%sb' %(limit), '-limit', 'map', '%sb' %(2*limit)))
+            
+        return executor.submit(RenderImage, jobPlan, srcImageL[i], hashD, 
+                               '%s_%s.png' %(tempBase, i), plan.draftcheck and i == 0, metaStoreD, useD)
+    
+    return ScheduleJobs(plan, [EstimateJobMemory(plan, fpn) for fpn in srcImageL], SubmitRender, outFNL)
+
+def FigClass(pD, jsonFPN, plan=None):
+    """ Process figures (images, photos) using ImageMagick
+    
+        :param pD: parameters for creating jekyll album
+        :type pD: dict
+        
+        :param jsonFPN: path to json parameter file
+        :type jsonFPN: str
+        
+        :param plan: render plan compiled from pD, compiled here if not given
+        :type plan: RenderPlan
+        
+        :return bodyL: markdown body text
+        :rtype bodyL: list
+    """
+    
+    LoadPIL()
+    
+    if plan is None:
+        
+        plan = CompileRenderPlan(pD, jsonFPN)
+    
+    bodyL = []
+    
+    heading1 = '#### %s' %(pD['content']['description'])
+    
+    bodyL.append(heading1)
+    
+    who = '%s %s' %( '**Who:**', ', '.join(pD['content']['persons']) )
+    
+    bodyL.append(who)
+    
+    where = '**Where :** %s (%s)' %( pD['metadata']['location'], pD['metadata']['country'])
+    
+    bodyL.append(where)
+    
+    bodyL.append('Mouse over the images to highlight, click to see larger pop-up images.')
+        
+    bodyL.append(plan.figureTag)
+        
+    # Create target folder
+    if not os.path.exists(plan.rollFP):
+        os.makedirs(plan.rollFP)
+        
+    # Shared rendition cache across rolls
+    cachePD = plan.cachePD
+    
+    hashD = useD = None
+    
+    if cachePD:
+        
+        if not os.path.exists(cachePD['cachefp']):
+            os.makedirs(cachePD['cachefp'])
+            
+        hashD = ReadSourceHashes(cachePD)
+        
+        useD = ReadCacheUse(cachePD)
+        
+    # Consolidated metadata store, read once and written once per roll
+    metaStoreD = ReadMetaStore(plan) if plan.metaStoreFPN else None
+            
+    # Get the list of images
+    lines = AlbumImageList(plan)
+    
+    if plan.dedupExact or plan.dedupNear:
+        
+        lines = DedupImageList(plan, lines, hashD)
+        
+    bodyL.extend( ScheduleRenderImages(plan, lines, hashD, metaStoreD, useD) )
+    
+    if metaStoreD is not None:
+        
+        WriteMetaStore(plan, metaStoreD)
+    
+    if cachePD:
+        
+        WriteSourceHashes(cachePD, hashD)
+        
+        CacheEvict(cachePD, useD)
+        
+        WriteCacheUse(cachePD, useD)
+
+    bodyL.append("<figcaption>%s</figcaption>" %(pD['content']['figcaption']))
+    
+    bodyL.append("</figure>")  
+      
     return bodyL
 
 def WritePost(pD, jsonFPN, yamlL, bodyL):
@@ -579,27 +2513,41 @@ def WritePost(pD, jsonFPN, yamlL, bodyL):
             
             f.write ('\n')
         
-def PilotJekyllAlbum(jsonFPN):
+def PilotJekyllAlbum(jsonFPN, jobs=0):
     """ Create Jekyll photo album from json command file
 
         :param jsonFPN: path to xml file
            :type jsonFPN: str
+           
+        :param jobs: if given, overrides the scheduler jobs
+           :type jobs: int
     """
     
     # Parse the json file
     with open(jsonFPN) as jsonF:
     
         pD = json.load(jsonF)
+        
+    if jobs:
+        
+        pD.setdefault('scheduler', {})
+        
+        pD['scheduler']['jobs'] = jobs
+        
+    LoadPIL()
+        
+    # Compile and validate the rendering once, bad parameters stop here
+    plan = CompileRenderPlan(pD, jsonFPN)
   
     # Create the Jekyll Yaml    
     yamlL = JekyllYaml(pD)
          
     # Create the markdown      
-    bodyL = FigClass(pD, jsonFPN)
+    bodyL = FigClass(pD, jsonFPN, plan)
     
     WritePost(pD, jsonFPN, yamlL, bodyL)
     
-def SetupProcesses(docpath, projFN):   
+def SetupProcesses(docpath, projFN, jobs=0, verbose=1):   
     '''Setup and loop processes
     
     :paramn docpath: path to text file 
@@ -607,6 +2555,12 @@ def SetupProcesses(docpath, projFN):
             
     :param projFN: project filename
     :rtype: str
+    
+    :param jobs: if given, overrides the scheduler jobs of all json files
+    :type jobs: int
+    
+    :param verbose: >1 reports the time taken for each json file
+    :type verbose: int
             
     '''
     
@@ -645,16 +2599,144 @@ def SetupProcesses(docpath, projFN):
     for jsonObj in jsonL:
         
         print ('jsonObj:', jsonObj)
+        
+        t0 = time.time()
                                 
-        PilotJekyllAlbum(jsonObj)
+        PilotJekyllAlbum(jsonObj, jobs)
         
-if __name__ == '__main__':
+        if verbose > 1:
+            
+            print ('    %s done in %.1f s' %(os.path.basename(jsonObj), time.time()-t0))
+
+def ProfileRun(profileFPN, traceMemoryFPN, func, *argL):
+    """ Run a function, optionally under cProfile and/or tracemalloc, and dump the results
+    
+        :param profileFPN: path for cProfile stats, False for no profiling
+        :type profileFPN: str
+        
+        :param traceMemoryFPN: path for the tracemalloc snapshot, False for no tracing
+        :type traceMemoryFPN: str
+        
+        :param func: function to run with argL
+        :type func: function
     """
+    
+    if traceMemoryFPN:
+        
+        import tracemalloc
+        
+        tracemalloc.start(25)
+        
+    try:
+        
+        if profileFPN:
+            
+            import cProfile, pstats
+            
+            profiler = cProfile.Profile()
+            
+            try:
+                
+                profiler.runcall(func, *argL)
+                
+            finally:
+                
+                profiler.dump_stats(profileFPN)
+                
+                print ('cProfile stats written to', profileFPN)
+                
+                pstats.Stats(profiler, stream = sys.stderr).sort_stats('cumulative').print_stats(30)
+                
+        else:
+            
+            func(*argL)
+            
+    finally:
+        
+        if traceMemoryFPN:
+            
+            snapshot = tracemalloc.take_snapshot()
+            
+            current, peak = tracemalloc.get_traced_memory()
+            
+            tracemalloc.stop()
+            
+            snapshot.dump(traceMemoryFPN)
+            
+            print ('tracemalloc snapshot written to %s, peak %.1f MB' %(traceMemoryFPN, peak/1024**2), file = sys.stderr)
+            
+            for statistic in snapshot.statistics('lineno')[0:20]:
+                
+                print ('    ', statistic, file = sys.stderr)
+
+def main(argv=None):
+    """ Command line entry point
+    
+        :param argv: arguments, default sys.argv[1:]
+        :type argv: list
     """
     
-    docpath = "/Volumes/karttur/bilder/se"
+    parser = argparse.ArgumentParser(description = 'Create Jekyll photo albums from the json parameter files listed in a project text file')
+    
+    parser.add_argument('projFPN', nargs = '?', help = 'project text file listing json parameter files')
+    
+    parser.add_argument('-j', '--jobs', type = int, default = 0, 
+                        help = 'concurrent image jobs (default: scheduler jobs in the json files)')
+    
+    parser.add_argument('-v', '--verbose', action = 'count', default = 1, help = 'also report the time taken for each json file')
+    
+    parser.add_argument('-q', '--quiet', action = 'store_true', help = 'no progress output on stdout, errors are still shown')
+    
+    parser.add_argument('--profile', metavar = 'FILE', default = False, 
+                        help = 'run under cProfile, dump stats to FILE and print the top functions')
+    
+    parser.add_argument('--trace-memory', metavar = 'FILE', default = False, 
+                        help = 'trace allocations with tracemalloc, dump the snapshot to FILE and print the top lines')
+    
+    parser.add_argument('--template', action = 'store_true', 
+                        help = 'write a template json parameter file next to the project file and exit')
+    
+    parser.add_argument('--query-meta', metavar = 'STORE', default = False, 
+                        help = 'print the records of a metadata store (.jsonl or .sqlite) as JSON lines and exit')
+    
+    parser.add_argument('--roll', default = False, help = 'with --query-meta, only this roll')
+    
+    parser.add_argument('--date-from', default = False, help = 'with --query-meta, captured on or after YYYYMMDD')
+    
+    parser.add_argument('--date-to', default = False, help = 'with --query-meta, captured on or before YYYYMMDD')
+    
+    parser.add_argument('--camera', default = False, help = 'with --query-meta, camera make or model containing this text')
+    
+    args = parser.parse_args(argv)
     
-    projFN = ("jekyllalbums_se.txt")
+    if args.query_meta:
+        
+        for recordD in QueryImageMeta(args.query_meta, args.roll, args.date_from, args.date_to, args.camera):
+            
+            print (json.dumps(recordD))
+            
+        return
+    
+    if not args.projFPN:
+        
+        parser.error('the project file is required')
+    
+    docpath, projFN = os.path.split(os.path.abspath(args.projFPN))
+    
+    if args.template:
+        
+        CreateParamJson(docpath)
+        
+        return
+    
+    with open(os.devnull, 'w') as devnullF:
+        
+        with contextlib.redirect_stdout(devnullF if args.quiet else sys.stdout):
+            
+            ProfileRun(args.profile, args.trace_memory, SetupProcesses, docpath, projFN, args.jobs, 0 if args.quiet else args.verbose)
+        
+if __name__ == '__main__':
+    """
+    """
     
-    SetupProcesses(docpath, projFN)
-    
\ No newline at end of file
+    main()
@@ -16,6 +16,36 @@ import json
 
 import hashlib
 
+import gzip
+
+import pickle
+
+import stat
+
+import shutil
+
+import select
+
+import struct
+
+import time
+
+import threading
+
+import re
+
+import fnmatch
+
+import argparse
+
+import contextlib
+
+from array import array
+
+from collections import namedtuple
+
+# ctypes (watch mode) and concurrent.futures (sharded mode) are imported where used
+
 def RemoveMatchingPathsParams():
     ''' Default parameters for removing duplicates in matching paths
     
@@ -46,6 +76,80 @@ def RemoveMatchingPathsParams():
     paramD['remove']['removeSmallerOlder'] = False
     
     paramD['deleleExtL'] = ['list','of','extensions','to','delete']
+    
+    paramD['index'] = {}
+    
+    paramD['index']['useIndex'] = False
+    
+    paramD['index']['indexFP'] = 'path/to/folder/for/saved/indexes'
+    
+    paramD['index']['rebuildIndex'] = False
+    
+    paramD['index']['checkIndex'] = True
+    
+    paramD['merkle'] = {}
+    
+    paramD['merkle']['useMerkle'] = False
+    
+    paramD['merkle']['reportN'] = 20
+    
+    paramD['watch'] = {}
+    
+    paramD['watch']['useWatch'] = False
+    
+    paramD['watch']['debounce'] = 5
+    
+    paramD['watch']['rescanInterval'] = 86400
+    
+    paramD['shard'] = {}
+    
+    paramD['shard']['useShard'] = False
+    
+    paramD['shard']['processes'] = 0
+    
+    paramD['shard']['shardFiles'] = 2000
+    
+    paramD['shard']['planOnly'] = False
+    
+    paramD['manifest'] = {}
+    
+    paramD['manifest']['useManifest'] = False
+    
+    paramD['manifest']['exportFP'] = 'path/to/folder/for/exported/manifests'
+    
+    paramD['manifest']['planFPN'] = 'path/to/deletion_plan.txt'
+    
+    paramD['manifest']['planOnly'] = False
+    
+    paramD['manifest']['applyPlanFPN'] = ''
+    
+    paramD['io'] = {}
+    
+    paramD['io']['scheduleReads'] = False
+    
+    paramD['io']['fiemap'] = True
+    
+    paramD['io']['batchFiles'] = 2000
+    
+    paramD['filter'] = {}
+    
+    paramD['filter']['excludeDirL'] = ['.git', 'node_modules', '__pycache__', '*.lrdata']
+    
+    paramD['filter']['excludeFileL'] = []
+    
+    paramD['filter']['includeFileL'] = []
+    
+    paramD['filter']['excludeRE'] = ''
+    
+    paramD['filter']['includeRE'] = ''
+    
+    paramD['filter']['extL'] = []
+    
+    paramD['filter']['maxDepth'] = 0
+    
+    paramD['filter']['minSize'] = 0
+    
+    paramD['filter']['maxSize'] = 0
      
     return (paramD)
 
@@ -84,6 +188,163 @@ def ReadRemoveMatchingPathsJson(jsonFPN):
         
     return (paramD)
 
+def GlobRules(globL):
+    """ Split glob patterns into a set of plain names and one compiled regex for the rest
+    
+        :param list globL: glob patterns, e.g. ['.git', '*.lrdata']
+        
+        :returns: set of plain names and compiled regex or None
+        :rtype: tuple
+    """
+    
+    nameS = set(g for g in globL if not any(c in g for c in '*?['))
+    
+    patternL = [fnmatch.translate(g) for g in globL if g not in nameS]
+    
+    return nameS, re.compile('|'.join(patternL)) if patternL else None
+
+class PathFilter:
+    """ Include/exclude rules for the main tree, compiled once and checked while walking
+    
+        Excluded folders are pruned before they are descended into. Every check is a
+        set lookup or a single regex match, independent of the number of rules.
+        Paths are relative to the root, folders directly under the root have depth 1.
+        
+        :param dict filterD: rules (excludeDirL, excludeFileL, includeFileL: globs on names;
+            excludeRE, includeRE: regex searched in relative paths; extL: file extensions
+            to consider; maxDepth: deepest folder level; minSize, maxSize: file sizes in bytes;
+            0 or empty means no rule)
+    """
+    
+    __slots__ = ('excludeDirS', 'excludeDirRE', 'excludeFileS', 'excludeFileRE', 'includeFileS', 'includeFileRE', 
+                 'excludeRE', 'includeRE', 'extS', 'maxDepth', 'minSize', 'maxSize', 'sizeRule')
+    
+    def __init__(self, filterD={}):
+        
+        self.excludeDirS, self.excludeDirRE = GlobRules(filterD.get('excludeDirL', []))
+        
+        self.excludeFileS, self.excludeFileRE = GlobRules(filterD.get('excludeFileL', []))
+        
+        self.includeFileS, self.includeFileRE = GlobRules(filterD.get('includeFileL', []))
+        
+        self.excludeRE = re.compile(filterD['excludeRE']) if filterD.get('excludeRE') else None
+        
+        self.includeRE = re.compile(filterD['includeRE']) if filterD.get('includeRE') else None
+        
+        self.extS = set(ext.lower() for ext in filterD.get('extL', []))
+        
+        self.maxDepth = int(filterD.get('maxDepth', 0))
+        
+        self.minSize = int(filterD.get('minSize', 0))
+        
+        self.maxSize = int(filterD.get('maxSize', 0))
+        
+        # callers only stat files for the size rule if there is one
+        self.sizeRule = bool(self.minSize or self.maxSize)
+        
+    def KeepDir(self, name, relFP, depth):
+        """ Check a folder before descending into it
+        
+            :param str name: folder name
+            
+            :param str relFP: folder path relative to the root
+            
+            :param int depth: folder level below the root
+            
+            :returns: False if the folder is excluded
+            :rtype: bool
+        """
+        
+        if self.maxDepth and depth > self.maxDepth:
+            
+            return False
+        
+        if name in self.excludeDirS or (self.excludeDirRE and self.excludeDirRE.match(name)):
+            
+            return False
+        
+        if self.excludeRE and self.excludeRE.search(relFP):
+            
+            return False
+        
+        return True
+    
+    def KeepFile(self, name, relFPN, size=None):
+        """ Check a file in a folder that is kept
+        
+            :param str name: file name
+            
+            :param str relFPN: file path relative to the root
+            
+            :param int size: file size, only needed if sizeRule is set
+            
+            :returns: False if the file is excluded
+            :rtype: bool
+        """
+        
+        if self.extS and os.path.splitext(name)[1].lower() not in self.extS:
+            
+            return False
+        
+        if name in self.excludeFileS or (self.excludeFileRE and self.excludeFileRE.match(name)):
+            
+            return False
+        
+        if (self.includeFileS or self.includeFileRE) and not (name in self.includeFileS or 
+                                                             (self.includeFileRE and self.includeFileRE.match(name))):
+            
+            return False
+        
+        if self.excludeRE and self.excludeRE.search(relFPN):
+            
+            return False
+        
+        if self.includeRE and not self.includeRE.search(relFPN):
+            
+            return False
+        
+        if size is not None:
+            
+            if size < self.minSize or (self.maxSize and size > self.maxSize):
+                
+                return False
+            
+        return True
+    
+    def KeepDirPath(self, relFP):
+        """ Check every folder level of a relative folder path, for paths not reached by walking
+        
+            :param str relFP: folder path relative to the root
+            
+            :returns: False if the folder or any of its parents is excluded
+            :rtype: bool
+        """
+        
+        partL = relFP.split(os.sep) if relFP else []
+        
+        for i, name in enumerate(partL):
+            
+            if not self.KeepDir(name, os.sep.join(partL[0:i+1]), i+1):
+                
+                return False
+            
+        return True
+    
+    def KeepFilePath(self, relFPN, size=None):
+        """ Check a file and all its parent folders, for paths not reached by walking
+        
+            :param str relFPN: file path relative to the root
+            
+            :param int size: file size, only needed if sizeRule is set
+            
+            :returns: False if the file or any of its parents is excluded
+            :rtype: bool
+        """
+        
+        relFP, name = os.path.split(relFPN)
+        
+        return self.KeepDirPath(relFP) and self.KeepFile(name, relFPN, size)
+
 def Hashfile(path, blocksize = 65536):
     """  Calculate hash for file
     
@@ -109,238 +370,2994 @@ def Hashfile(path, blocksize = 65536):
         
     afile.close()
     
-    return hasher.hexdigest()   
+    return hasher.hexdigest()
 
-def RemoveMatchingPaths(mainpath, exampath, removeHidden=True, removeDSstore = True, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[]):
-    """ Search ad delete matching files and subfolders
+# Reusable buffer pair for CompareFiles, one per thread
+compareLocal = threading.local()
+
+def ReadFull(fileObj, view):
+    """  Fill a buffer from a file, continuing after short reads
+    
+        Unbuffered reads can return less than asked for before the end of the file,
+        e.g. on network file systems.
+    
+        :param fileObj: file opened unbuffered for binary reading
         
-        :param str mainpath: root folder path for main directory to keep
+        :param memoryview view: buffer to fill
         
-        :param str exampath: root folder path for examination directory to clean
+        :returns: bytes read, less than len(view) only at the end of the file
+        :rtype: int
+    """
+    
+    n = 0
+    
+    while n < len(view):
         
-        :param bool removeHidden: Remove duplicates of hidden files 
+        nRead = fileObj.readinto(view[n:])
         
-        :param bool removeDSstore: Remove duplicates of .DSstore (macOS) 
+        if not nRead:
+            
+            break
         
-        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        n += nRead
         
-        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    return n
+
+def CompareFiles(pathA, pathB, bufsize = 1048576):
+    """  Compare the content of two files, reading both in lockstep and stopping at the first differing chunk
     
-        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
-    """
+        No digest is calculated; use Hashfile only where the hash is kept for later.
+        The files are only reported equal once both have been read to the end.
     
-    if mainpath == exampath:
+        :param str pathA: file path
         
-        sys.exit('EXITING mainpath == exampath')
+        :param str pathB: file path
         
-    if not os.path.isdir(mainpath):
+        :param int bufsize: bytes read from each file per step
         
-        sys.exit('EXITING mainpath does not exist',mainpath)
+        :returns: True if the files have identical content
+        :rtype: bool
+    """
+    
+    bufL = getattr(compareLocal, 'bufL', None)
+    
+    if bufL is None or len(bufL[0]) != bufsize:
         
-    if not os.path.isdir(exampath):
+        bufL = compareLocal.bufL = [bytearray(bufsize), bytearray(bufsize)]
         
-        sys.exit('EXITING exampath does not exist',exampath)
+    bufA, bufB = bufL
+    
+    viewA, viewB = memoryview(bufA), memoryview(bufB)
+    
+    with open(pathA, 'rb', buffering = 0) as fA, open(pathB, 'rb', buffering = 0) as fB:
         
-    for root, dirs, nofiles in os.walk(mainpath, topdown=True):
+        size = os.fstat(fA.fileno()).st_size
         
-        if not removeHidden:
+        if size != os.fstat(fB.fileno()).st_size:
             
-            dirs[:] = [d for d in dirs if not d[0] == '.']
+            return False
+        
+        total = 0
+        
+        while True:
             
-        for subdir in dirs:
+            nA = ReadFull(fA, viewA)
             
-            mainsubpath = os.path.join(root,subdir)
+            nB = ReadFull(fB, viewB)
             
-            examsubroot = root.replace(mainpath, exampath)
+            if nA != nB:
+                
+                return False
             
-            examsubpath = os.path.join(examsubroot,subdir)
+            if nA == 0:
+                
+                # both at the end, and all of both files was compared
+                return total == size
             
-            if os.path.isdir(examsubpath):
+            if nA == bufsize:
                 
-                #if removeDSstore, just remove it directly
-                if removeDSstore:
-                    
-                    dsStore = os.path.join(examsubpath,'.DS_Store')
-                    
-                    if os.path.isfile(dsStore):
-                        
-                        os.remove(dsStore)
-                        
-                # list and loop files in the main path under examination      
-                for file in os.listdir(mainsubpath):
-                    
-                    if file[0] == '.' and not removeHidden:
-                        
-                        continue
+                # Full chunks are compared in place
+                if bufA != bufB:
                     
-                    mainFile = os.path.join(mainsubpath,file)
-                    
-                    if os.path.isfile(mainFile):
+                    return False
+                
+            elif bufA[:nA] != bufB[:nB]:
+                
+                return False
+            
+            total += nA
 
-                        # Gett he corresponding file name in the exam path
-                        examFile = os.path.join(examsubpath,file)
-                        
-                        # if the exampath has a copy of the main path file
-                        if os.path.isfile(examFile):
-                            
-                            print ('Duplicate file',examsubpath,file)
-        
-                            if removeAllDupl or deleleExtL[0] == '*':
-                                
-                                print ('Deleting by name',examFile)
-                                
-                                os.remove(examFile)
-                                
-                            elif os.path.splitext(examFile)[1] in deleleExtL:
-                                
-                                print ('Deleting by extension',examFile)
-                                
-                                os.remove(examFile)
-                                
-                            else:  
-                                  
-                                main_hash = Hashfile(mainFile)
-                                
-                                exam_hash = Hashfile(examFile)
-                                
-                                if main_hash == exam_hash:
-                                    
-                                    print ('Deleting by md5 hash',examFile)
-                                                                            
-                                    os.remove(examFile)
-                                
-                                else: # md5 hash not the same
-                                      
-                                    #Get date and size
-                                    examDate = os.path.getmtime(examFile)
-                                    
-                                    mainDate = os.path.getmtime(mainFile)
-                                    
-                                    if removeSmallerOlder:
-                                        
-                                        if examDate < mainDate:
-                                            
-                                            examSize = os.path.getsize(examFile)
-                                            
-                                            mainSize = os.path.getsize(mainFile)
-                                            
-                                            if examSize < mainSize:
-                                                
-                                                print ('Deleting older and smaller', examFile)
-
-                                                os.remove(examFile)
-                                                
-                                            else:
-                                                print('Content differs, both kept:')
-                                                
-                                                print ('    ',mainFile)
-                                                
-                                                print ('    ',examFile)
-                                                
-                                        else:
-                                            print('Content differs, both kept:')
-                                            
-                                            print ('    ',mainFile)
-                                            
-                                            print ('    ',examFile)
-                                    else:    
-                                           
-                                        print('Content differs, both kept:')
-                                        
-                                        print ('    ',mainFile)
-                                        
-                                        print ('    ',examFile)
-                                        
-                                print ('')
-
-def RemoveEmptyFolders(path):
-    """ Remove empty directories
-    
-        :param str path: folder path to check if empty and remove
-    """
+# Linux ioctl for the extent map of a file, from <linux/fs.h>
+FS_IOC_FIEMAP = 0xC020660B
 
-    if not os.path.isdir(path):
+def PhysicalOffset(path, ino, fiemap=True):
+    """ Sort key placing a file by its position on disk
+    
+        The physical offset of the first extent is read with FIEMAP where the platform
+        and file system support it, otherwise the inode number is used, which on most
+        file systems roughly follows allocation order.
+    
+        :param str path: file path
         
-        return
-
-    files = os.listdir(path)
+        :param int ino: inode number
+        
+        :param bool fiemap: try FIEMAP (Linux)
+        
+        :returns: sort key
+        :rtype: tuple
+    """
     
-    if len(files):
+    if fiemap and sys.platform.startswith('linux'):
         
-        for f in files:
+        import fcntl
+        
+        # struct fiemap header (32 bytes) asking for one struct fiemap_extent (56 bytes)
+        buf = bytearray(struct.pack('=QQLLLL', 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)) + bytearray(56)
+        
+        try:
             
-            fullpath = os.path.join(path, f)
+            fd = os.open(path, os.O_RDONLY)
             
-            if os.path.isdir(fullpath):
+            try:
                 
-                RemoveEmptyFolders(fullpath)
+                fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+                
+            finally:
+                
+                os.close(fd)
+                
+            # fm_mapped_extents, then fe_physical of the first extent unless it is
+            # FIEMAP_EXTENT_UNKNOWN, FIEMAP_EXTENT_DELALLOC or FIEMAP_EXTENT_DATA_INLINE
+            if struct.unpack_from('=L', buf, 20)[0] and not struct.unpack_from('=L', buf, 72)[0] & 0x206:
+                
+                return (0, struct.unpack_from('=Q', buf, 40)[0])
+            
+        except OSError:
+            
+            pass
+        
+    return (1, ino)
+
+# st_dev to physical disk, filled by PhysicalDevice
+physicalDeviceD = {}
+
+def PhysicalDevice(dev):
+    """ Identify the disk holding a device, so that partitions of one disk share a reader
     
-    # if folder empty, delete it
-    files = os.listdir(path)
+        :param int dev: st_dev of a file
+        
+        :returns: disk name from /sys/dev/block (Linux), otherwise dev
+        :rtype: str or int
+    """
     
-    if len(files) == 0:
+    if dev not in physicalDeviceD:
         
-        print ("Removing empty folder:", path)
+        physicalDeviceD[dev] = dev
         
-        os.rmdir(path)
+        blockFP = os.path.realpath('/sys/dev/block/%s:%s' %(os.major(dev), os.minor(dev)))
         
-    elif len(files) == 1 and files[0] == '.DS_Store':
+        if os.path.isdir(blockFP):
+            
+            # a partition is listed under its disk
+            if os.path.isfile(os.path.join(blockFP, 'partition')):
+                
+                blockFP = os.path.dirname(blockFP)
+                
+            physicalDeviceD[dev] = os.path.basename(blockFP)
+            
+    return physicalDeviceD[dev]
+
+def ReadDeviceHashes(jobL, posL, hashL, fiemap=True):
+    """ Reader for one disk: hash its files in physical order
+    
+        :param list jobL: (path, st_dev, st_ino) per file
         
-        os.remove(os.path.join(path,'.DS_Store'))
+        :param list posL: positions in jobL of the files on this disk
         
-        os.rmdir(path)
-                    
-def LoopMatchingPaths(mainFP, examFPL, removeHidden, removeDSstore, removeAllDupl, removeRoot, removeSmallerOlder, deleleExtL):
+        :param list hashL: hex digest per job, filled in place
+        
+        :param bool fiemap: order by FIEMAP extent offset where available
     """
-        :param str mainFP: root folder path for main directory to keep
+    
+    posL.sort(key = lambda pos: PhysicalOffset(jobL[pos][0], jobL[pos][2], fiemap))
+    
+    for pos in posL:
         
-        :param list examFPL: root folder paths for examination directory to clean
+        try:
+            
+            hashL[pos] = Hashfile(jobL[pos][0], 1048576)
+            
+        except OSError as e:
+            
+            print ('Cannot read', jobL[pos][0], e)
+
+def ScheduledHashes(jobL, fiemap=True):
+    """ md5 hashes for a batch of files, read in physical order with one reader per disk
+    
+        Files are grouped by disk and each group is sorted by position on the disk, so
+        that each disk is read mostly sequentially while different disks are read in parallel.
+    
+        :param list jobL: (path, st_dev, st_ino) per file
+        
+        :param bool fiemap: order by FIEMAP extent offset where available, otherwise by inode
+        
+        :returns: hex digest, or None if the file could not be read, per job
+        :rtype: list
+    """
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    diskD = {}
+    
+    for pos, job in enumerate(jobL):
+        
+        diskD.setdefault(PhysicalDevice(job[1]), []).append(pos)
+        
+    hashL = [None]*len(jobL)
+    
+    with ThreadPoolExecutor(max_workers = max(1, len(diskD))) as executor:
+        
+        futureL = [executor.submit(ReadDeviceHashes, jobL, posL, hashL, fiemap) for posL in diskD.values()]
+        
+        for future in futureL:
+            
+            future.result()
+            
+    return hashL
+
+class TreeIndex:
+    """ Compact in-memory index of a directory tree
+
+        Directories are kept in a table of (parent, name) rows and the files of
+        each directory are stored contiguously. File names are packed as UTF-8
+        into one buffer, and the per-file size, mtime, inode, device and cached
+        md5 digest are kept in parallel array columns, so no path strings or
+        per-file objects are held in memory. Directory mtimes are kept to tell if a saved index is stale,
+        and directories holding entries that are not indexed (symlinks, devices,
+        sockets, fifos) or that could not be listed are flagged as special.
+
+        :param str rootFP: root folder path of the indexed tree
+    """
+
+    __slots__ = ('rootFP', 'dirParentA', 'dirNameL', 'dirFirstA', 'dirCountA', 'dirMtimeA', 'dirSpecialA',
+                 'fileNameB', 'fileNameEndA', 'sizeA', 'mtimeA', 'inodeA', 'devA', 'hashA', 'hashedA')
+
+    version = 6
+
+    def __init__(self, rootFP):
+
+        self.rootFP = rootFP
+
+        # Directory table, row 0 is the root itself
+        self.dirParentA = array('l')
+
+        self.dirNameL = []
+
+        self.dirFirstA = array('Q')
+
+        self.dirCountA = array('L')
+
+        self.dirMtimeA = array('d')
+
+        # set if the directory has content the index does not describe
+        self.dirSpecialA = array('B')
+
+        # File columns, the name of file row r is fileNameB[fileNameEndA[r-1]:fileNameEndA[r]]
+        self.fileNameB = bytearray()
+
+        self.fileNameEndA = array('Q')
+
+        self.sizeA = array('q')
+
+        self.mtimeA = array('d')
+
+        self.inodeA = array('Q')
+
+        # st_dev per file, a tree may span mounted disks
+        self.devA = array('Q')
+
+        # Cached md5 digests, 16 bytes per file, valid where hashedA is set
+        self.hashA = bytearray()
+
+        self.hashedA = array('B')
+
+    def __len__(self):
+
+        return len(self.sizeA)
+
+    def AddDir(self, parent, name, mtime=0.0):
+        """ Add a directory row, its files must be added directly after
+
+            :param int parent: row of the parent directory, -1 for the root
+
+            :param str name: directory name
+
+            :param float mtime: directory modification time, 0 if unknown
+
+            :returns: directory row
+            :rtype: int
+        """
+
+        self.dirParentA.append(parent)
+
+        self.dirNameL.append(sys.intern(name))
+
+        self.dirFirstA.append(len(self.sizeA))
+
+        self.dirCountA.append(0)
+
+        self.dirMtimeA.append(mtime)
+
+        self.dirSpecialA.append(0)
+
+        return len(self.dirNameL)-1
+
+    def AddFile(self, dirRow, name, st):
+        """ Add a file to the directory last added
+
+            :param int dirRow: directory row
+
+            :param str name: file name
+
+            :param st: stat result for the file
+            :type st: os.stat_result
+        """
+
+        self.fileNameB.extend(name.encode('utf-8', 'surrogateescape'))
+
+        self.fileNameEndA.append(len(self.fileNameB))
+
+        self.sizeA.append(st.st_size)
+
+        self.mtimeA.append(st.st_mtime)
+
+        self.inodeA.append(st.st_ino)
+
+        self.devA.append(st.st_dev)
+
+        self.hashA.extend(bytes(16))
+
+        self.hashedA.append(0)
+
+        self.dirCountA[dirRow] += 1
+
+    def FileName(self, fileRow):
+        """ Name of a file row, decoded from the packed names
+
+            :param int fileRow: file row
+
+            :returns: file name
+            :rtype: str
+        """
+
+        start = self.fileNameEndA[fileRow-1] if fileRow else 0
+
+        return self.fileNameB[start:self.fileNameEndA[fileRow]].decode('utf-8', 'surrogateescape')
+
+    def DirRelPath(self, dirRow):
+        """ Relative path of a directory row, '' for the root
+
+            :param int dirRow: directory row
+
+            :returns: path relative to rootFP
+            :rtype: str
+        """
+
+        partL = []
+
+        while dirRow > 0:
+
+            partL.append(self.dirNameL[dirRow])
+
+            dirRow = self.dirParentA[dirRow]
+
+        partL.reverse()
+
+        return os.path.join('',*partL)
+
+    def DirFiles(self, dirRow):
+        """ File rows of a directory
+
+            :param int dirRow: directory row
+
+            :returns: file rows
+            :rtype: range
+        """
+
+        first = self.dirFirstA[dirRow]
+
+        return range(first, first+self.dirCountA[dirRow])
+
+    def ChildDirs(self):
+        """ Subdirectory rows of each directory row
+
+            :returns: list of child row lists
+            :rtype: list
+        """
+
+        childL = [[] for _ in range(len(self.dirNameL))]
+
+        for dirRow in range(1, len(self.dirNameL)):
+
+            childL[self.dirParentA[dirRow]].append(dirRow)
+
+        return childL
+
+    def FileHash(self, fileRow, fileFPN):
+        """ md5 digest of a file, calculated only if not cached
+
+            :param int fileRow: file row
+
+            :param str fileFPN: full path to the file
+
+            :returns: raw md5 digest
+            :rtype: bytes
+        """
+
+        start = 16*fileRow
+
+        if not self.hashedA[fileRow]:
+
+            self.hashA[start:start+16] = bytes.fromhex(Hashfile(fileFPN))
+
+            self.hashedA[fileRow] = 1
+
+        return bytes(self.hashA[start:start+16])
+
+    def SetFileHash(self, fileRow, digest):
+        """ Cache a digest calculated elsewhere
+
+            :param int fileRow: file row
+
+            :param bytes digest: raw md5 digest
+        """
+
+        self.hashA[16*fileRow:16*fileRow+16] = digest
+
+        self.hashedA[fileRow] = 1
+
+    def CopyHashes(self, oldIndex):
+        """ Reuse cached digests from an older index of the same tree for files with unchanged size and mtime
+
+            :param TreeIndex oldIndex: earlier index of the same root
+
+            :returns: number of digests reused
+            :rtype: int
+        """
+
+        dirRowD = {}
+
+        for dirRow, relFP in self.IterDirs():
+
+            dirRowD[relFP] = dirRow
+
+        reused = 0
+
+        for oldDirRow, relFP in oldIndex.IterDirs():
+
+            if relFP not in dirRowD:
+
+                continue
+
+            oldRowL = [r for r in oldIndex.DirFiles(oldDirRow) if oldIndex.hashedA[r]]
+
+            if not oldRowL:
+
+                continue
+
+            fileRowD = {}
+
+            for fileRow in self.DirFiles(dirRowD[relFP]):
+
+                fileRowD[self.FileName(fileRow)] = fileRow
+
+            for oldRow in oldRowL:
+
+                fileRow = fileRowD.get(oldIndex.FileName(oldRow))
+
+                if fileRow is None:
+
+                    continue
+
+                if self.sizeA[fileRow] != oldIndex.sizeA[oldRow] or self.mtimeA[fileRow] != oldIndex.mtimeA[oldRow]:
+
+                    continue
+
+                self.hashA[16*fileRow:16*fileRow+16] = oldIndex.hashA[16*oldRow:16*oldRow+16]
+
+                self.hashedA[fileRow] = 1
+
+                reused += 1
+
+        return reused
+
+    def ChangedDir(self):
+        """ Find a directory that changed since the index was built
+
+            Adding, removing or renaming an entry changes the modification time
+            of its directory, editing a file in place does not.
+
+            :returns: relative path of the first changed or missing directory, None if all are unchanged
+            :rtype: str
+        """
+
+        for dirRow, relFP in self.IterDirs():
+
+            try:
+
+                mtime = os.stat(os.path.join(self.rootFP, relFP)).st_mtime
+
+            except OSError:
+
+                return relFP
+
+            if mtime != self.dirMtimeA[dirRow]:
+
+                return relFP
+
+        return None
+
+    def IterDirs(self):
+        """ Iterate directories as (row, relative path)
+        """
+
+        for dirRow in range(len(self.dirNameL)):
+
+            yield dirRow, self.DirRelPath(dirRow)
+
+    def Save(self, indexFPN):
+        """ Write the index as a compressed pickle, replacing any earlier one only when complete
+
+            :param str indexFPN: path to index file
+        """
+
+        stateD = {'version': self.version}
+
+        for key in self.__slots__:
+
+            stateD[key] = getattr(self, key)
+
+        with gzip.open(indexFPN+'.tmp', 'wb', compresslevel = 6) as indexF:
+
+            pickle.dump(stateD, indexF, protocol = pickle.HIGHEST_PROTOCOL)
+
+        os.replace(indexFPN+'.tmp', indexFPN)
+
+    @classmethod
+    def Load(cls, indexFPN):
+        """ Read an index written by Save
+
+            :param str indexFPN: path to index file
+
+            :returns: index or None if the file is not a valid index
+            :rtype: TreeIndex
+        """
+
+        try:
+
+            with gzip.open(indexFPN, 'rb') as indexF:
+
+                stateD = pickle.load(indexF)
+
+            if stateD.get('version') != cls.version:
+
+                return None
+
+            index = cls(stateD['rootFP'])
+
+            for key in cls.__slots__:
+
+                setattr(index, key, stateD[key])
+
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError) as e:
+
+            # e.g. a save that was interrupted by an earlier version
+            print ('Ignoring unreadable index', indexFPN, e)
+
+            return None
+
+        # Re-intern the names, pickle does not preserve interning across runs
+        index.dirNameL = [sys.intern(n) for n in index.dirNameL]
+
+        return index
+
+def BuildTreeIndex(rootFP, removeHidden=True):
+    """ Walk a directory tree and build a compact index
+
+        :param str rootFP: root folder path
+
+        :param bool removeHidden: include hidden files and folders
+
+        :returns: tree index
+        :rtype: TreeIndex
+    """
+
+    index = TreeIndex(rootFP)
+
+    try:
+
+        rootMtime = os.stat(rootFP).st_mtime
+
+    except OSError:
+
+        rootMtime = 0.0
+
+    # the mtime is taken before listing, so changes made while listing show as stale
+    stack = [(-1, '', rootFP, rootMtime)]
+
+    while stack:
+
+        parent, name, dirFP, mtime = stack.pop()
+
+        dirRow = index.AddDir(parent, name, mtime)
+
+        try:
+
+            entryL = list(os.scandir(dirFP))
+
+        except OSError as e:
+
+            print ('Cannot list folder', dirFP, e)
+
+            index.dirSpecialA[dirRow] = 1
+
+            continue
+
+        subdirL = []
+
+        for entry in entryL:
+
+            if entry.name[0] == '.' and not removeHidden:
+
+                continue
+
+            try:
+
+                st = entry.stat(follow_symlinks = False)
+
+            except OSError:
+
+                index.dirSpecialA[dirRow] = 1
+
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+
+                subdirL.append( (entry.name, st.st_mtime) )
+
+            elif stat.S_ISREG(st.st_mode):
+
+                index.AddFile(dirRow, entry.name, st)
+
+            else:
+
+                # symlinks and special files are not indexed
+                index.dirSpecialA[dirRow] = 1
+
+        # Push in reverse to visit subfolders in listing order
+        for subdir, mtime in reversed(subdirL):
+
+            stack.append( (dirRow, subdir, os.path.join(dirFP,subdir), mtime) )
+
+    return index
+
+def TreeIndexFPN(indexFP, rootFP):
+    """ Path to the saved index for a root folder
+
+        :param str indexFP: folder holding saved indexes
+
+        :param str rootFP: root folder path of the indexed tree
+
+        :returns: index file path
+        :rtype: str
+    """
+
+    rootFP = os.path.abspath(rootFP)
+
+    rootHash = hashlib.md5(rootFP.encode('utf-8')).hexdigest()[0:12]
+
+    indexFN = '%s_%s.idx.gz' %(os.path.basename(rootFP.rstrip(os.sep)) or 'root', rootHash)
+
+    return os.path.join(indexFP, indexFN)
+
+def GetTreeIndex(rootFP, indexFP, rebuildIndex=False, refresh=False, checkIndex=True):
+    """ Load a saved tree index or build and save a new one
+    
+        Saved indexes always include hidden files and folders, filtering is done
+        by the consumers. A saved index is only reused as is if no directory
+        changed since it was built; files edited in place keep their directory
+        mtime, so use refresh or rebuildIndex if that may have happened.
+
+        :param str rootFP: root folder path
+
+        :param str indexFP: folder holding saved indexes, if empty nothing is saved
+
+        :param bool rebuildIndex: ignore any saved index
+
+        :param bool refresh: always walk the tree, but reuse cached digests from a saved index
+
+        :param bool checkIndex: compare the saved directory mtimes, and walk the tree if any changed
+
+        :returns: tree index
+        :rtype: TreeIndex
+    """
+
+    indexFPN = oldIndex = False
+
+    if indexFP:
+
+        indexFPN = TreeIndexFPN(indexFP, rootFP)
+
+        if os.path.isfile(indexFPN) and not rebuildIndex:
+
+            oldIndex = TreeIndex.Load(indexFPN)
+
+            if oldIndex is not None and not refresh:
+
+                age = (time.time() - os.path.getmtime(indexFPN)) / 3600
+
+                changedFP = oldIndex.ChangedDir() if checkIndex else None
+
+                if changedFP is None:
+
+                    print ('Loaded index', indexFPN, len(oldIndex), 'files, saved %.1f h ago' %(age))
+
+                    if not checkIndex:
+
+                        print ('    not checked against the tree, deletions may act on outdated entries')
+
+                    return oldIndex
+
+                print ('Saved index', indexFPN, 'is out of date (%s changed), walking the tree' %(os.path.join(rootFP, changedFP)))
+
+    index = BuildTreeIndex(rootFP)
+
+    print ('Indexed', rootFP, len(index), 'files')
+
+    if oldIndex:
+
+        print ('    reused', index.CopyHashes(oldIndex), 'cached hashes')
+
+    if indexFPN:
+
+        SaveTreeIndex(index, indexFP)
+
+    return index
+
+def SaveTreeIndex(index, indexFP):
+    """ Save a tree index under the folder for saved indexes
+
+        :param TreeIndex index: tree index
+
+        :param str indexFP: folder holding saved indexes
+    """
+
+    if not os.path.exists(indexFP):
+
+        os.makedirs(indexFP)
+
+    index.Save(TreeIndexFPN(indexFP, index.rootFP))
+
+def DuplicateDecision(mainFile, examFile, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], sameContent=None):
+    """ Decide if the exam copy of a file with the same relative path as a main file is to be deleted
+    
+        :param str mainFile: path to file in main directory to keep
+        
+        :param str examFile: path to file with the same relative path in the examination directory
+        
+        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        
+        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    
+        :param set deleleExtL: File extensions to delete; if it holds '*' all identified copies are deleted
+        
+        :param bool sameContent: result of a content comparison already done, None to compare here
+        
+        :returns: reason for deletion ('by name', 'by extension', 'by content', 'older and smaller') or None if kept
+        :rtype: str
+    """
+
+    if removeAllDupl or '*' in deleleExtL:
+        
+        return 'by name'
+        
+    if os.path.splitext(examFile)[1] in deleleExtL:
+        
+        return 'by extension'
+          
+    if sameContent is None:
+        
+        # No hash is kept, compare the content directly
+        sameContent = CompareFiles(mainFile, examFile)
+          
+    if sameContent:
+        
+        return 'by content'
+    
+    # content not the same
+    if removeSmallerOlder:
+        
+        #Get date and size
+        if os.path.getmtime(examFile) < os.path.getmtime(mainFile):
+            
+            if os.path.getsize(examFile) < os.path.getsize(mainFile):
+                
+                return 'older and smaller'
+            
+    return None
+
+def RemoveDuplicateFile(mainFile, examFile, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], sameContent=None):
+    """ Compare a file in the main path with its namesake in the exam path and delete the exam copy if it is a duplicate
+    
+        :param str mainFile: path to file in main directory to keep
+        
+        :param str examFile: path to file with the same relative path in the examination directory
+        
+        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        
+        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    
+        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
+        
+        :param bool sameContent: result of a content comparison already done, None to compare here
+    """
+    
+    print ('Duplicate file',os.path.dirname(examFile),os.path.basename(examFile))
+    
+    reason = DuplicateDecision(mainFile, examFile, removeAllDupl, removeSmallerOlder, deleleExtL, sameContent)
+
+    if reason:
+        
+        print ('Deleting %s' %(reason),examFile)
+        
+        os.remove(examFile)
+        
+    else:
+        
+        print('Content differs, both kept:')
+        
+        print ('    ',mainFile)
+        
+        print ('    ',examFile)
+                
+    print ('')
+
+def RemoveDuplicateBatch(pairL, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], fiemap=True):
+    """ Compare and delete a batch of (mainFile, examFile) pairs with reads scheduled per disk
+    
+        Pairs of equal size that are not decided by name or extension are hashed with
+        ScheduledHashes, so the main and exam disks are each read in physical order and
+        in parallel instead of alternating between them file by file.
+    
+        :param list pairL: (mainFile, examFile) pairs
+        
+        :param bool fiemap: order reads by FIEMAP extent offset where available
+        
+        Other parameters as for RemoveDuplicateFile
+    """
+    
+    sameL = [None]*len(pairL)
+    
+    goneS = set()
+    
+    jobL = []
+    
+    hashPairL = []
+    
+    for i, (mainFile, examFile) in enumerate(pairL):
+        
+        if removeAllDupl or '*' in deleleExtL or os.path.splitext(examFile)[1] in deleleExtL:
+            
+            continue
+        
+        try:
+            
+            mainSt = os.stat(mainFile)
+            
+            examSt = os.stat(examFile)
+            
+        except OSError:
+            
+            goneS.add(i)
+            
+            continue
+        
+        if mainSt.st_size != examSt.st_size:
+            
+            sameL[i] = False
+            
+            continue
+        
+        hashPairL.append( (i, len(jobL)) )
+        
+        jobL.append( (mainFile, mainSt.st_dev, mainSt.st_ino) )
+        
+        jobL.append( (examFile, examSt.st_dev, examSt.st_ino) )
+        
+    hashL = ScheduledHashes(jobL, fiemap)
+    
+    for i, j in hashPairL:
+        
+        if hashL[j] is None or hashL[j+1] is None:
+            
+            goneS.add(i)
+            
+        else:
+            
+            sameL[i] = hashL[j] == hashL[j+1]
+            
+    for i, (mainFile, examFile) in enumerate(pairL):
+        
+        if i not in goneS:
+            
+            RemoveDuplicateFile(mainFile, examFile, removeAllDupl, removeSmallerOlder, deleleExtL, sameL[i])
+
+def RemoveMatchingPaths(mainpath, exampath, removeHidden=True, removeDSstore = True, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], mainIndex=None, pathFilter=None, ioD={}):
+    """ Search ad delete matching files and subfolders
+        
+        :param str mainpath: root folder path for main directory to keep
+        
+        :param str exampath: root folder path for examination directory to clean
+        
+        :param bool removeHidden: Remove duplicates of hidden files 
+        
+        :param bool removeDSstore: Remove duplicates of .DSstore (macOS) 
+        
+        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        
+        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    
+        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
+        
+        :param TreeIndex mainIndex: index of mainpath, if given it replaces walking mainpath
+        
+        :param PathFilter pathFilter: include/exclude rules, excluded folders are not walked
+        
+        :param dict ioD: read scheduling (scheduleReads, fiemap, batchFiles), see RemoveDuplicateBatch
+    """
+    
+    if mainpath == exampath:
+        
+        sys.exit('EXITING mainpath == exampath')
+        
+    if not os.path.isdir(mainpath):
+        
+        sys.exit('EXITING mainpath does not exist',mainpath)
+        
+    if not os.path.isdir(exampath):
+        
+        sys.exit('EXITING exampath does not exist',exampath)
+        
+    if mainIndex is not None:
+        
+        RemoveMatchingIndexPaths(mainIndex, exampath, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL, pathFilter, ioD)
+        
+        return
+    
+    # pairs waiting for scheduled reads, None to compare each pair directly
+    batchL = [] if ioD.get('scheduleReads') else None
+        
+    for root, dirs, nofiles in os.walk(mainpath, topdown=True):
+        
+        if not removeHidden:
+            
+            dirs[:] = [d for d in dirs if not d[0] == '.']
+            
+        relRoot = root[len(mainpath):].lstrip(os.sep)
+            
+        if pathFilter is not None:
+            
+            depth = relRoot.count(os.sep) + 2 if relRoot else 1
+            
+            dirs[:] = [d for d in dirs if pathFilter.KeepDir(d, os.path.join(relRoot,d), depth)]
+            
+        for subdir in dirs:
+            
+            mainsubpath = os.path.join(root,subdir)
+            
+            examsubroot = root.replace(mainpath, exampath)
+            
+            examsubpath = os.path.join(examsubroot,subdir)
+            
+            if os.path.isdir(examsubpath):
+                
+                #if removeDSstore, just remove it directly
+                if removeDSstore:
+                    
+                    dsStore = os.path.join(examsubpath,'.DS_Store')
+                    
+                    if os.path.isfile(dsStore):
+                        
+                        os.remove(dsStore)
+                        
+                # list and loop files in the main path under examination      
+                for file in os.listdir(mainsubpath):
+                    
+                    if file[0] == '.' and not removeHidden:
+                        
+                        continue
+                    
+                    mainFile = os.path.join(mainsubpath,file)
+                    
+                    if os.path.isfile(mainFile):
+                        
+                        if pathFilter is not None and not pathFilter.KeepFile(file, os.path.join(relRoot,subdir,file), 
+                                                                                os.path.getsize(mainFile) if pathFilter.sizeRule else None):
+                            
+                            continue
+
+                        # Gett he corresponding file name in the exam path
+                        examFile = os.path.join(examsubpath,file)
+                        
+                        # if the exampath has a copy of the main path file
+                        if os.path.isfile(examFile):
+                            
+                            if batchL is None:
+                            
+                                RemoveDuplicateFile(mainFile, examFile, removeAllDupl, removeSmallerOlder, deleleExtL)
+                                
+                                continue
+                            
+                            batchL.append( (mainFile, examFile) )
+                            
+                            if len(batchL) >= ioD.get('batchFiles', 2000):
+                                
+                                RemoveDuplicateBatch(batchL, removeAllDupl, removeSmallerOlder, deleleExtL, ioD.get('fiemap', True))
+                                
+                                batchL = []
+                                
+    if batchL:
+        
+        RemoveDuplicateBatch(batchL, removeAllDupl, removeSmallerOlder, deleleExtL, ioD.get('fiemap', True))
+
+def ExaminedDirRows(index, removeHidden=True, pathFilter=None):
+    """ Directories of an index whose files are examined, as when walking
+    
+        :param TreeIndex index: tree index of the main directory
+        
+        :param bool removeHidden: examine hidden folders
+        
+        :param PathFilter pathFilter: include/exclude rules
+        
+        :returns: True per directory row if its files are examined
+        :rtype: list
+    """
+    
+    # parents precede their subfolders in the index, so exclusion and depth follow from the parent row
+    keptL = [True]*len(index.dirNameL)
+    
+    depthL = [0]*len(index.dirNameL)
+    
+    examineL = [False]*len(index.dirNameL)
+    
+    for dirRow, relFP in index.IterDirs():
+        
+        # as with walking, files directly under the root are not examined
+        if dirRow == 0:
+            
+            continue
+        
+        parent = index.dirParentA[dirRow]
+        
+        depthL[dirRow] = depthL[parent] + 1
+        
+        if pathFilter is not None:
+            
+            keptL[dirRow] = keptL[parent] and pathFilter.KeepDir(index.dirNameL[dirRow], relFP, depthL[dirRow])
+            
+        if not keptL[dirRow]:
+            
+            continue
+        
+        if not removeHidden and any(part[0] == '.' for part in relFP.split(os.sep)):
+            
+            continue
+        
+        examineL[dirRow] = True
+        
+    return examineL
+
+def RemoveMatchingIndexPaths(mainIndex, exampath, removeHidden=True, removeDSstore = True, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], pathFilter=None, ioD={}):
+    """ Search and delete matching files using an index of the main directory
+        
+        :param TreeIndex mainIndex: index of root folder for main directory to keep
+        
+        :param str exampath: root folder path for examination directory to clean
+        
+        :param bool removeHidden: Remove duplicates of hidden files 
+        
+        :param bool removeDSstore: Remove duplicates of .DSstore (macOS) 
+        
+        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        
+        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    
+        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
+        
+        :param PathFilter pathFilter: include/exclude rules, the saved index itself is unfiltered
+        
+        :param dict ioD: read scheduling (scheduleReads, fiemap, batchFiles), see RemoveDuplicateBatch
+    """
+    
+    mainpath = mainIndex.rootFP
+    
+    # pairs waiting for scheduled reads, None to compare each pair directly
+    batchL = [] if ioD.get('scheduleReads') else None
+    
+    examineL = ExaminedDirRows(mainIndex, removeHidden, pathFilter)
+    
+    for dirRow, relFP in mainIndex.IterDirs():
+        
+        if not examineL[dirRow]:
+            
+            continue
+        
+        examsubpath = os.path.join(exampath,relFP)
+        
+        if not os.path.isdir(examsubpath):
+            
+            continue
+        
+        if removeDSstore:
+            
+            dsStore = os.path.join(examsubpath,'.DS_Store')
+            
+            if os.path.isfile(dsStore):
+                
+                os.remove(dsStore)
+                
+        mainsubpath = os.path.join(mainpath,relFP)
+                
+        for fileRow in mainIndex.DirFiles(dirRow):
+            
+            file = mainIndex.FileName(fileRow)
+            
+            if file[0] == '.' and not removeHidden:
+                
+                continue
+            
+            if pathFilter is not None and not pathFilter.KeepFile(file, os.path.join(relFP,file), mainIndex.sizeA[fileRow]):
+                
+                continue
+            
+            examFile = os.path.join(examsubpath,file)
+            
+            if os.path.isfile(examFile):
+                
+                mainFile = os.path.join(mainsubpath,file)
+                
+                # the index may be older than the tree
+                if not os.path.isfile(mainFile):
+                    
+                    continue
+                
+                if batchL is None:
+                
+                    RemoveDuplicateFile(mainFile, examFile, removeAllDupl, removeSmallerOlder, deleleExtL)
+                    
+                    continue
+                
+                batchL.append( (mainFile, examFile) )
+                
+                if len(batchL) >= ioD.get('batchFiles', 2000):
+                    
+                    RemoveDuplicateBatch(batchL, removeAllDupl, removeSmallerOlder, deleleExtL, ioD.get('fiemap', True))
+                    
+                    batchL = []
+                    
+    if batchL:
+        
+        RemoveDuplicateBatch(batchL, removeAllDupl, removeSmallerOlder, deleleExtL, ioD.get('fiemap', True))
+
+def ScanShard(mainpath, exampath, relFPL, optionD, shardFiles):
+    """ Worker: decide duplicates below a set of main subfolders without deleting anything
+    
+        Folders are visited depth first. Once shardFiles files have been compared the
+        unvisited folders are handed back, so that the coordinator can spread them over
+        other workers and one huge subfolder does not serialize the run.
+        
+        :param str mainpath: root folder path for main directory to keep
+        
+        :param str exampath: root folder path for examination directory to clean
+        
+        :param list relFPL: folder paths relative to the roots to start from
+        
+        :param dict optionD: removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL and pathFilter
+        
+        :param int shardFiles: number of files to compare before handing back remaining folders
+        
+        :returns: deletions as (examFile, reason), kept pairs as (mainFile, examFile), stats and unvisited folders
+        :rtype: tuple
+    """
+    
+    removeHidden = optionD['removeHidden']
+    
+    pathFilter = optionD.get('pathFilter')
+    
+    deleteL = []
+    
+    keptL = []
+    
+    statD = {'folders': 0, 'compared': 0, 'deleted': 0, 'kept': 0, 'bytes': 0}
+    
+    stack = list(reversed(relFPL))
+    
+    while stack:
+        
+        if statD['folders'] and statD['compared'] >= shardFiles:
+            
+            break
+        
+        relFP = stack.pop()
+        
+        mainsubpath = os.path.join(mainpath,relFP)
+        
+        examsubpath = os.path.join(exampath,relFP)
+        
+        # nothing below can have a counterpart if the exam folder is missing
+        if not os.path.isdir(examsubpath):
+            
+            continue
+        
+        statD['folders'] += 1
+        
+        try:
+            
+            entryL = list(os.scandir(mainsubpath))
+            
+        except OSError as e:
+            
+            print ('Cannot list folder', mainsubpath, e)
+            
+            continue
+        
+        subdirL = []
+        
+        depth = relFP.count(os.sep) + 2 if relFP else 1
+        
+        for entry in entryL:
+            
+            if entry.name[0] == '.' and not removeHidden:
+                
+                continue
+            
+            if entry.is_dir(follow_symlinks = False):
+                
+                subRelFP = os.path.join(relFP,entry.name)
+                
+                if pathFilter is None or pathFilter.KeepDir(entry.name, subRelFP, depth):
+                
+                    subdirL.append(subRelFP)
+                
+        stack.extend(reversed(subdirL))
+        
+        # as with walking, files directly under the root are not examined
+        if not relFP:
+            
+            continue
+        
+        if optionD['removeDSstore']:
+            
+            dsStore = os.path.join(examsubpath,'.DS_Store')
+            
+            if os.path.isfile(dsStore):
+                
+                deleteL.append( (dsStore, '.DS_Store') )
+        
+        for entry in entryL:
+            
+            if entry.name[0] == '.' and not removeHidden:
+                
+                continue
+            
+            if not entry.is_file():
+                
+                continue
+            
+            if pathFilter is not None and not pathFilter.KeepFile(entry.name, os.path.join(relFP,entry.name), 
+                                                                    entry.stat().st_size if pathFilter.sizeRule else None):
+                
+                continue
+            
+            examFile = os.path.join(examsubpath,entry.name)
+            
+            if not os.path.isfile(examFile):
+                
+                continue
+            
+            statD['compared'] += 1
+            
+            reason = DuplicateDecision(entry.path, examFile, optionD['removeAllDupl'], optionD['removeSmallerOlder'], optionD['deleleExtL'])
+            
+            if reason:
+                
+                deleteL.append( (examFile, reason) )
+                
+                statD['deleted'] += 1
+                
+                statD['bytes'] += os.path.getsize(examFile)
+                
+            else:
+                
+                keptL.append( (entry.path, examFile) )
+                
+                statD['kept'] += 1
+        
+    return deleteL, keptL, statD, stack
+
+def ShardMatchingPaths(mainpath, exampath, removeHidden=True, removeDSstore = True, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], processes=0, shardFiles=2000, planOnly=False, pathFilter=None):
+    """ Search and delete matching files with the main folder split into shards over a process pool
+    
+        Shards start as the top level subfolders of mainpath. Workers only decide,
+        all deletions are done (or, with planOnly, printed) by this coordinator.
+        
+        :param str mainpath: root folder path for main directory to keep
+        
+        :param str exampath: root folder path for examination directory to clean
+        
+        :param int processes: worker processes, 0 for one per cpu
+        
+        :param int shardFiles: files compared per shard before a worker hands back unvisited folders
+        
+        :param bool planOnly: only print the planned deletions
+        
+        Other parameters as for RemoveMatchingPaths
+        
+        :returns: merged stats
+        :rtype: dict
+    """
+    
+    if mainpath == exampath:
+        
+        sys.exit('EXITING mainpath == exampath')
+        
+    optionD = {'removeHidden': removeHidden, 'removeDSstore': removeDSstore, 
+               'removeAllDupl': removeAllDupl, 'removeSmallerOlder': removeSmallerOlder,
+               'deleleExtL': deleleExtL, 'pathFilter': pathFilter}
+    
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    
+    processes = processes or os.cpu_count() or 1
+    
+    totalD = {'shards': 0, 'folders': 0, 'compared': 0, 'deleted': 0, 'kept': 0, 'bytes': 0}
+    
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        
+        # The root shard itself only lists the top level and hands back its subfolders
+        pendingS = set([executor.submit(ScanShard, mainpath, exampath, [''], optionD, 0)])
+        
+        while pendingS:
+            
+            doneS, pendingS = wait(pendingS, return_when = FIRST_COMPLETED)
+            
+            for future in doneS:
+                
+                deleteL, keptL, statD, spillL = future.result()
+                
+                totalD['shards'] += 1
+                
+                for key in statD:
+                    
+                    totalD[key] += statD[key]
+                
+                # Spread the handed back folders over idle workers, one shard per folder
+                # while there are few, otherwise in groups
+                groupSize = max(1, len(spillL) // (4*processes))
+                
+                for i in range(0, len(spillL), groupSize):
+                    
+                    pendingS.add(executor.submit(ScanShard, mainpath, exampath, spillL[i:i+groupSize], optionD, shardFiles))
+                
+                for examFile, reason in deleteL:
+                    
+                    if planOnly:
+                        
+                        print ('Planned deletion %s' %(reason), examFile)
+                        
+                        continue
+                    
+                    if reason != '.DS_Store':
+                    
+                        print ('Deleting %s' %(reason), examFile)
+                    
+                    try:
+                        
+                        os.remove(examFile)
+                        
+                    except OSError as e:
+                        
+                        print ('Cannot delete', examFile, e)
+                        
+                for mainFile, examFile in keptL:
+                    
+                    print('Content differs, both kept:')
+                    
+                    print ('    ',mainFile)
+                    
+                    print ('    ',examFile)
+                    
+    print ('Sharded scan: %(shards)s shards, %(folders)s folders, %(compared)s files compared, %(deleted)s duplicates (%(bytes)s bytes), %(kept)s kept' %totalD)
+    
+    return totalD
+
+def SubtreeSignatures(index, skipNameS=set()):
+    """ Bottom-up size, file count and hidden flag for every directory subtree
+
+        :param TreeIndex index: tree index
+
+        :param set skipNameS: file names left out, e.g. .DS_Store
+
+        :returns: lists of subtree bytes, subtree file counts and hidden flags, per directory row
+        :rtype: tuple
+    """
+
+    nDirs = len(index.dirNameL)
+
+    sizeL = [0]*nDirs
+
+    countL = [0]*nDirs
+
+    hiddenL = [False]*nDirs
+
+    # children always have higher rows than their parents
+    for dirRow in range(nDirs-1, -1, -1):
+
+        for fileRow in index.DirFiles(dirRow):
+
+            name = index.FileName(fileRow)
+
+            if name in skipNameS:
+
+                continue
+
+            sizeL[dirRow] += index.sizeA[fileRow]
+
+            countL[dirRow] += 1
+
+            if name[0] == '.':
+
+                hiddenL[dirRow] = True
+
+        if dirRow > 0:
+
+            parent = index.dirParentA[dirRow]
+
+            sizeL[parent] += sizeL[dirRow]
+
+            countL[parent] += countL[dirRow]
+
+            if hiddenL[dirRow] or index.dirNameL[dirRow][0] == '.':
+
+                hiddenL[parent] = True
+
+    return sizeL, countL, hiddenL
+
+def SubtreeExcluded(index, pathFilter):
+    """ Flag directories that contain a folder or file the filter excludes, at any depth
+
+        Such a subtree is not identical in the filter's view even if its digest
+        matches, and removing it would delete excluded content.
+
+        :param TreeIndex index: tree index
+
+        :param PathFilter pathFilter: include/exclude rules
+
+        :returns: True per directory row if its subtree holds excluded content
+        :rtype: list
+    """
+
+    nDirs = len(index.dirNameL)
+
+    depthL = [0]*nDirs
+
+    excludedL = [False]*nDirs
+
+    relFPL = ['']*nDirs
+
+    # parents precede their subfolders, so exclusion and depth follow from the parent row
+    for dirRow, relFP in index.IterDirs():
+
+        relFPL[dirRow] = relFP
+
+        if dirRow > 0:
+
+            depthL[dirRow] = depthL[index.dirParentA[dirRow]] + 1
+
+            excludedL[dirRow] = not pathFilter.KeepDir(index.dirNameL[dirRow], relFP, depthL[dirRow])
+
+    # then bottom up, a folder holds excluded content if any file or subfolder does
+    for dirRow in range(nDirs-1, -1, -1):
+
+        if not excludedL[dirRow]:
+
+            for fileRow in index.DirFiles(dirRow):
+
+                name = index.FileName(fileRow)
+
+                size = index.sizeA[fileRow] if pathFilter.sizeRule else None
+
+                if not pathFilter.KeepFile(name, os.path.join(relFPL[dirRow], name), size):
+
+                    excludedL[dirRow] = True
+
+                    break
+
+        if dirRow > 0 and excludedL[dirRow]:
+
+            excludedL[index.dirParentA[dirRow]] = True
+
+    return excludedL
+
+def MerkleDigests(index, sizeL, countL, candidateS, skipNameS=set()):
+    """ Merkle digest per directory from child names and content hashes
+
+        Only directories whose (bytes, files) signature is in candidateS get a digest,
+        all others are None. A directory can only be identical to another if all its
+        subdirectories are, so files are hashed only below candidate directories.
+        Special directories (see TreeIndex) and so all their parents get no digest.
+
+        :param TreeIndex index: tree index
+
+        :param list sizeL: subtree bytes per directory row
+
+        :param list countL: subtree file counts per directory row
+
+        :param set candidateS: (bytes, files) signatures worth hashing
+
+        :param set skipNameS: file names left out, e.g. .DS_Store
+
+        :returns: raw md5 digest or None per directory row
+        :rtype: list
+    """
+
+    nDirs = len(index.dirNameL)
+
+    childL = index.ChildDirs()
+
+    digestL = [None]*nDirs
+
+    for dirRow in range(nDirs-1, -1, -1):
+
+        if (sizeL[dirRow], countL[dirRow]) not in candidateS or index.dirSpecialA[dirRow]:
+
+            continue
+
+        if any(digestL[child] is None for child in childL[dirRow]):
+
+            continue
+
+        dirFP = os.path.join(index.rootFP, index.DirRelPath(dirRow))
+
+        entryL = []
+
+        for fileRow in index.DirFiles(dirRow):
+
+            name = index.FileName(fileRow)
+
+            if name in skipNameS:
+
+                continue
+
+            try:
+
+                fileHash = index.FileHash(fileRow, os.path.join(dirFP, name))
+
+            except OSError:
+
+                break
+
+            entryL.append( (b'F', name.encode('utf-8', 'surrogateescape'), fileHash) )
+
+        else:
+
+            for child in childL[dirRow]:
+
+                entryL.append( (b'D', index.dirNameL[child].encode('utf-8', 'surrogateescape'), digestL[child]) )
+
+            hasher = hashlib.md5()
+
+            for kind, name, digest in sorted(entryL):
+
+                hasher.update(kind)
+
+                hasher.update(name)
+
+                hasher.update(b'\x00')
+
+                hasher.update(digest)
+
+            digestL[dirRow] = hasher.digest()
+
+    return digestL
+
+def MerkleHashJobs(index, sizeL, countL, candidateS, skipNameS=set()):
+    """ Files that MerkleDigests will hash, found without reading any file
+
+        A directory gets a digest only if its signature and those of all its
+        subdirectories are candidates, so only files in such directories are listed.
+
+        :param TreeIndex index: tree index
+
+        Other parameters as for MerkleDigests
+
+        :returns: file rows and jobs (path, st_dev, st_ino) for ScheduledHashes
+        :rtype: tuple
+    """
+
+    nDirs = len(index.dirNameL)
+
+    childL = index.ChildDirs()
+
+    eligibleL = [False]*nDirs
+
+    fileRowL = []
+
+    jobL = []
+
+    for dirRow in range(nDirs-1, -1, -1):
+
+        if (sizeL[dirRow], countL[dirRow]) not in candidateS or index.dirSpecialA[dirRow]:
+
+            continue
+
+        if not all(eligibleL[child] for child in childL[dirRow]):
+
+            continue
+
+        eligibleL[dirRow] = True
+
+        dirFP = os.path.join(index.rootFP, index.DirRelPath(dirRow))
+
+        for fileRow in index.DirFiles(dirRow):
+
+            if index.hashedA[fileRow] or index.FileName(fileRow) in skipNameS:
+
+                continue
+
+            fileRowL.append(fileRow)
+
+            jobL.append( (os.path.join(dirFP, index.FileName(fileRow)), index.devA[fileRow], index.inodeA[fileRow]) )
+
+    return fileRowL, jobL
+
+def RemoveIdenticalSubtrees(mainIndex, examIndex, removeHidden=True, removeDSstore=True, reportN=20, pathFilter=None, ioD={}, planOnly=False):
+    """ Remove exam subtrees that are identical to the main subtree at the same relative path
+
+        Identical subtrees anywhere in the exam tree are reported, largest first.
+
+        :param TreeIndex mainIndex: fresh index of root folder for main directory to keep
+
+        :param TreeIndex examIndex: fresh index of root folder for examination directory to clean
+
+        :param bool removeHidden: Remove duplicates of hidden files, if False subtrees with hidden content are kept
+
+        :param bool removeDSstore: disregard .DS_Store (macOS) when comparing subtrees
+
+        :param int reportN: number of largest identical subtrees to report
+        
+        :param PathFilter pathFilter: include/exclude rules, subtrees holding excluded content are neither removed nor reported
+
+        :param dict ioD: read scheduling (scheduleReads, fiemap), if set the files of both trees are hashed with ScheduledHashes first
+
+        :param bool planOnly: only print the subtrees that would be removed
+
+        :returns: number of subtrees and bytes removed, or planned for removal
+        :rtype: tuple
+    """
+
+    skipNameS = set(['.DS_Store']) if removeDSstore else set()
+
+    mainSizeL, mainCountL, mainHiddenL = SubtreeSignatures(mainIndex, skipNameS)
+
+    examSizeL, examCountL, examHiddenL = SubtreeSignatures(examIndex, skipNameS)
+
+    # Only subtrees with a (bytes, files) signature present on both sides can be identical
+    mainSigS = set( (mainSizeL[r], mainCountL[r]) for r in range(len(mainSizeL)) if mainCountL[r] )
+
+    candidateS = set( (examSizeL[r], examCountL[r]) for r in range(len(examSizeL)) if examCountL[r] ) & mainSigS
+
+    if ioD.get('scheduleReads'):
+
+        # hash both trees in one batch, one reader per disk in physical order
+        mainRowL, jobL = MerkleHashJobs(mainIndex, mainSizeL, mainCountL, candidateS, skipNameS)
+
+        examRowL, examJobL = MerkleHashJobs(examIndex, examSizeL, examCountL, candidateS, skipNameS)
+
+        hashL = ScheduledHashes(jobL + examJobL, ioD.get('fiemap', True))
+
+        for treeIndex, fileRow, fileHash in zip([mainIndex]*len(mainRowL) + [examIndex]*len(examRowL), mainRowL + examRowL, hashL):
+
+            if fileHash is not None:
+
+                treeIndex.SetFileHash(fileRow, bytes.fromhex(fileHash))
+
+    mainDigestL = MerkleDigests(mainIndex, mainSizeL, mainCountL, candidateS, skipNameS)
+
+    examDigestL = MerkleDigests(examIndex, examSizeL, examCountL, candidateS, skipNameS)
+
+    examExcludedL = SubtreeExcluded(examIndex, pathFilter) if pathFilter is not None else [False]*len(examDigestL)
+
+    mainRelD = {}
+
+    mainDigestD = {}
+
+    for dirRow, relFP in mainIndex.IterDirs():
+
+        if mainDigestL[dirRow] is not None:
+
+            mainRelD[relFP] = mainDigestL[dirRow]
+
+            mainDigestD.setdefault(mainDigestL[dirRow], relFP)
+
+    removedS = set()
+
+    reportedS = set()
+
+    identicalL = []
+
+    nRemoved = bytesRemoved = 0
+
+    for dirRow, relFP in examIndex.IterDirs():
+
+        parent = examIndex.dirParentA[dirRow]
+
+        # descendants of a removed subtree are skipped
+        if parent in removedS:
+
+            removedS.add(dirRow)
+
+            continue
+
+        digest = examDigestL[dirRow]
+
+        if digest is None or digest not in mainDigestD or examExcludedL[dirRow]:
+
+            continue
+
+        # only the topmost identical subtree is reported
+        if parent not in reportedS:
+
+            identicalL.append( (examSizeL[dirRow], examCountL[dirRow], mainDigestD[digest], relFP) )
+
+        reportedS.add(dirRow)
+
+        if dirRow == 0 or mainRelD.get(relFP) != digest:
+
+            continue
+
+        if examHiddenL[dirRow] and not removeHidden:
+
+            continue
+
+        examFP = os.path.join(examIndex.rootFP, relFP)
+
+        if planOnly:
+
+            print ('Planned deletion of identical subtree', examFP, examCountL[dirRow], 'files', examSizeL[dirRow], 'bytes')
+
+        else:
+
+            print ('Deleting identical subtree', examFP, examCountL[dirRow], 'files', examSizeL[dirRow], 'bytes')
+
+            shutil.rmtree(examFP)
+
+        removedS.add(dirRow)
+
+        nRemoved += 1
+
+        bytesRemoved += examSizeL[dirRow]
+
+    if reportN and identicalL:
+
+        identicalL.sort(reverse = True)
+
+        print ('Largest identical subtrees (bytes, files, main, exam):')
+
+        for size, count, mainRelFP, examRelFP in identicalL[0:reportN]:
+
+            print ('    %s %s %s %s' %(size, count, os.path.join(mainIndex.rootFP, mainRelFP), os.path.join(examIndex.rootFP, examRelFP)))
+
+        print ('')
+
+    return nRemoved, bytesRemoved
+
+def RemoveEmptyFolders(path, keepRoot=False):
+    """ Remove empty directories
+    
+        :param str path: folder path to check if empty and remove
+        
+        :param bool keepRoot: only remove empty subfolders, never path itself
+    """
+
+    if not os.path.isdir(path):
+        
+        return
+
+    files = os.listdir(path)
+    
+    if len(files):
+        
+        for f in files:
+            
+            fullpath = os.path.join(path, f)
+            
+            if os.path.isdir(fullpath):
+                
+                RemoveEmptyFolders(fullpath)
+    
+    if keepRoot:
+        
+        return
+    
+    # if folder empty, delete it
+    files = os.listdir(path)
+    
+    if len(files) == 0:
+        
+        print ("Removing empty folder:", path)
+        
+        os.rmdir(path)
+        
+    elif len(files) == 1 and files[0] == '.DS_Store':
+        
+        os.remove(os.path.join(path,'.DS_Store'))
+        
+        os.rmdir(path)
+                    
+def LoopMatchingPaths(mainFP, examFPL, removeHidden, removeDSstore, removeAllDupl, removeRoot, removeSmallerOlder, deleleExtL, indexD={}, merkleD={}, shardD={}, filterD={}, ioD={}, keepRoots=False):
+    """
+        :param str mainFP: root folder path for main directory to keep
+        
+        :param list examFPL: root folder paths for examination directory to clean
         
         :param bool removeHidden: Remove duplicates of hidden files 
         
-        :param bool removeDSstore: Remove duplicates of .DSstore (macOS) 
+        :param bool removeDSstore: Remove duplicates of .DSstore (macOS) 
+        
+        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        
+        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
+    
+        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
+        
+        :param dict indexD: tree index settings (useIndex, indexFP, rebuildIndex, checkIndex: reuse a saved index only if no directory mtime changed)
+        
+        :param dict merkleD: directory Merkle hash settings (useMerkle, reportN)
+        
+        :param dict shardD: multi-process settings (useShard, processes, shardFiles, planOnly: only print planned deletions, also of Merkle subtrees)
+        
+        :param dict filterD: include/exclude rules for the main tree, see PathFilter
+        
+        :param dict ioD: read scheduling for rotational disks (scheduleReads, fiemap, batchFiles)
+        
+        :param bool keepRoots: never remove an emptied exam root, as in watch mode where it carries a watch
+    """
+    
+    pathFilter = PathFilter(filterD) if filterD else None
+    
+    # extensions are looked up once per duplicate
+    deleleExtL = set(deleleExtL)
+    
+    loopL = [mainFP]
+    
+    loopL.extend(examFPL)
+
+    for index, mainFolder in enumerate(loopL):
+             
+        if not os.path.isdir(mainFolder):
+            
+            continue
+
+        if index == len(loopL)-1:
+            
+            break
+        
+        print ('mainfolder', index, mainFolder)
+        
+        mainIndex = None
+        
+        indexFP = indexD.get('indexFP') if indexD.get('useIndex') else False
+        
+        if merkleD.get('useMerkle'):
+            
+            # Wholesale removal must never rely on a stale tree, only hashes are reused
+            mainIndex = GetTreeIndex(mainFolder, indexFP, indexD.get('rebuildIndex', False), True)
+        
+        elif indexD.get('useIndex'):
+            
+            mainIndex = GetTreeIndex(mainFolder, indexFP, indexD.get('rebuildIndex', False), False, indexD.get('checkIndex', True))
+        
+        for examIndex in range(index+1,len(loopL)):
+            
+            examFolder = loopL[examIndex]
+
+            print ('    examFolder',examFolder)
+            
+            if not os.path.isdir(examFolder):
+                continue
+                                 
+            examRoot = examFolder
+            
+            if merkleD.get('useMerkle'):
+                
+                examTreeIndex = GetTreeIndex(examFolder, indexFP, indexD.get('rebuildIndex', False), True)
+                
+                # planOnly holds for the wholesale removal too
+                nRemoved, bytesRemoved = RemoveIdenticalSubtrees(mainIndex, examTreeIndex, removeHidden, removeDSstore, merkleD.get('reportN', 20), pathFilter, ioD, 
+                                                                 shardD.get('planOnly', False))
+                
+                print ('    %s %s identical subtrees, %s bytes' %('planned' if shardD.get('planOnly') else 'removed', nRemoved, bytesRemoved))
+                
+                if indexFP:
+                    
+                    # keep the calculated hashes for the next run
+                    SaveTreeIndex(mainIndex, indexFP)
+                    
+                    SaveTreeIndex(examTreeIndex, indexFP)
+        
+            if shardD.get('useShard'):
+                
+                ShardMatchingPaths(mainFolder, examFolder, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL, 
+                                   shardD.get('processes', 0), shardD.get('shardFiles', 2000), shardD.get('planOnly', False), pathFilter)
+                
+                if shardD.get('planOnly'):
+                    
+                    continue
+            
+            else:
+            
+                RemoveMatchingPaths(mainFolder, examFolder, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL, mainIndex, pathFilter, ioD)
+                
+            RemoveEmptyFolders(examRoot, keepRoots)
+            
+
+# The stat fields TreeIndex.AddFile uses, for files read from a manifest
+ManifestStat = namedtuple('ManifestStat', ['st_size', 'st_mtime', 'st_ino', 'st_dev'])
+
+def ManifestFPN(exportFP, rootFP):
+    """ Path to the exported manifest of a root folder
+
+        :param str exportFP: folder for exported manifests
+
+        :param str rootFP: root folder path of the tree
+
+        :returns: manifest file path
+        :rtype: str
+    """
+
+    return TreeIndexFPN(exportFP, rootFP)[0:-len('.idx.gz')] + '.manifest.jsonl.gz'
+
+def SaveManifest(index, manifestFPN):
+    """ Write a tree index as a manifest, gzipped JSON Lines holding data only
+
+        The first line is a header with the root path, then each directory as
+        {"dir": [parent row, name]} followed by its files as
+        [name, size, mtime, inode, md5 hex or null].
+
+        :param TreeIndex index: tree index, normally fully hashed
+
+        :param str manifestFPN: path to manifest file
+    """
+
+    with gzip.open(manifestFPN+'.tmp', 'wt', encoding = 'utf-8', errors = 'surrogateescape') as manifestF:
+
+        manifestF.write(json.dumps({'manifest': 1, 'rootFP': index.rootFP}) + '\n')
+
+        for dirRow in range(len(index.dirNameL)):
+
+            manifestF.write(json.dumps({'dir': [index.dirParentA[dirRow], index.dirNameL[dirRow]]}) + '\n')
+
+            for fileRow in index.DirFiles(dirRow):
+
+                fileHash = index.hashA[16*fileRow:16*fileRow+16].hex() if index.hashedA[fileRow] else None
+
+                manifestF.write(json.dumps([index.FileName(fileRow), index.sizeA[fileRow], index.mtimeA[fileRow],
+                                            index.inodeA[fileRow], fileHash]) + '\n')
+
+    os.replace(manifestFPN+'.tmp', manifestFPN)
+
+def ManifestName(name):
+    """ Check a directory or file name read from a manifest
+
+        :param name: name as read
+        :type name: str
+
+        :returns: True if it is a single, plain path component
+        :rtype: bool
+    """
+
+    return isinstance(name, str) and name not in ('', '.', '..') and os.sep not in name and '/' not in name and '\x00' not in name
+
+def LoadManifest(manifestFPN):
+    """ Read a manifest written by SaveManifest, validating every field
+
+        Manifests may come from other machines, so nothing but plain data is read
+        and names that are not single path components are rejected.
+
+        :param str manifestFPN: path to manifest file
+
+        :returns: tree index, or None if the file is not a valid manifest
+        :rtype: TreeIndex
+    """
+
+    try:
+
+        with gzip.open(manifestFPN, 'rt', encoding = 'utf-8', errors = 'surrogateescape') as manifestF:
+
+            headerD = json.loads(manifestF.readline())
+
+            if not isinstance(headerD, dict) or headerD.get('manifest') != 1 or not isinstance(headerD.get('rootFP'), str):
+
+                return None
+
+            index = TreeIndex(headerD['rootFP'])
+
+            dirRow = -1
+
+            for line in manifestF:
+
+                item = json.loads(line)
+
+                if isinstance(item, dict):
+
+                    parent, name = item['dir']
+
+                    if dirRow == -1:
+
+                        if parent != -1 or name != '':
+
+                            return None
+
+                    elif not (type(parent) is int and 0 <= parent <= dirRow and ManifestName(name)):
+
+                        return None
+
+                    dirRow = index.AddDir(parent, name)
+
+                    continue
+
+                name, size, mtime, ino, fileHash = item
+
+                if dirRow == -1 or not ManifestName(name) or type(size) is not int or type(ino) is not int or not isinstance(mtime, (int, float)):
+
+                    return None
+
+                # the device is local to the machine that wrote the manifest
+                index.AddFile(dirRow, name, ManifestStat(size, float(mtime), ino, 0))
+
+                if fileHash is not None:
+
+                    digest = bytes.fromhex(fileHash)
+
+                    if len(digest) != 16:
+
+                        return None
+
+                    index.SetFileHash(len(index)-1, digest)
+
+    except (OSError, EOFError, ValueError, TypeError, KeyError, OverflowError):
+
+        return None
+
+    if dirRow == -1:
+
+        return None
+
+    return index
+
+def HashTreeIndex(index, ioD={}):
+    """ Hash all files of an index that have no cached digest
+
+        :param TreeIndex index: tree index of a local tree
+
+        :param dict ioD: read scheduling (scheduleReads, fiemap), see ScheduledHashes
+
+        :returns: number of files hashed
+        :rtype: int
+    """
+
+    fileRowL = []
+
+    jobL = []
+
+    for dirRow, relFP in index.IterDirs():
+
+        dirFP = os.path.join(index.rootFP, relFP)
+
+        for fileRow in index.DirFiles(dirRow):
+
+            if not index.hashedA[fileRow]:
+
+                fileRowL.append(fileRow)
+
+                jobL.append( (os.path.join(dirFP, index.FileName(fileRow)), index.devA[fileRow], index.inodeA[fileRow]) )
+
+    if ioD.get('scheduleReads'):
+
+        hashL = ScheduledHashes(jobL, ioD.get('fiemap', True))
+
+    else:
+
+        hashL = []
+
+        for fileFPN, dev, ino in jobL:
+
+            try:
+
+                hashL.append(Hashfile(fileFPN))
+
+            except OSError as e:
+
+                print ('Cannot read', fileFPN, e)
+
+                hashL.append(None)
+
+    nHashed = 0
+
+    for fileRow, fileHash in zip(fileRowL, hashL):
+
+        if fileHash is not None:
+
+            index.SetFileHash(fileRow, bytes.fromhex(fileHash))
+
+            nHashed += 1
+
+    return nHashed
+
+def ManifestDuplicateDecision(mainIndex, mainRow, examIndex, examRow, relFPN, mainLive, examLive, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[]):
+    """ DuplicateDecision for two indexed files, either of which may only be known from a manifest
+
+        Files of a live tree are hashed on demand, a manifest only offers the digests it was exported with.
+
+        :param TreeIndex mainIndex: index or manifest of the main directory
+
+        :param int mainRow: file row in mainIndex
+
+        :param TreeIndex examIndex: index or manifest of the examination directory
+
+        :param int examRow: file row in examIndex
+
+        :param str relFPN: file path relative to both roots
+
+        :param bool mainLive: mainIndex is a local tree
+
+        :param bool examLive: examIndex is a local tree
+
+        Other parameters as for DuplicateDecision
+
+        :returns: reason for deletion or None if kept
+        :rtype: str
+    """
+
+    if removeAllDupl or '*' in deleleExtL:
+
+        return 'by name'
+
+    if os.path.splitext(relFPN)[1] in deleleExtL:
+
+        return 'by extension'
+
+    mainSize, examSize = mainIndex.sizeA[mainRow], examIndex.sizeA[examRow]
+
+    if mainSize == examSize and (mainLive or mainIndex.hashedA[mainRow]) and (examLive or examIndex.hashedA[examRow]):
+
+        try:
+
+            if mainIndex.FileHash(mainRow, os.path.join(mainIndex.rootFP, relFPN)) == examIndex.FileHash(examRow, os.path.join(examIndex.rootFP, relFPN)):
+
+                return 'by md5 hash'
+
+        except OSError:
+
+            return None
+
+    if removeSmallerOlder:
+
+        if examIndex.mtimeA[examRow] < mainIndex.mtimeA[mainRow] and examSize < mainSize:
+
+            return 'older and smaller'
+
+    return None
+
+def ManifestPlan(mainIndex, examIndex, mainLive, examLive, removeHidden=True, removeDSstore=True, removeAllDupl=False, removeSmallerOlder=False, deleleExtL=[], pathFilter=None):
+    """ Plan the deletion of exam files that duplicate main files at matching paths, from indexes or manifests
+
+        :param TreeIndex mainIndex: index or manifest of the main directory
+
+        :param TreeIndex examIndex: index or manifest of the examination directory
+
+        :param bool mainLive: mainIndex is a local tree
+
+        :param bool examLive: examIndex is a local tree
+
+        Other parameters as for RemoveMatchingIndexPaths
+
+        :returns: planned deletions as (exam file row, relative path, reason) and number of kept pairs
+        :rtype: tuple
+    """
+
+    examineL = ExaminedDirRows(mainIndex, removeHidden, pathFilter)
+
+    examDirD = {}
+
+    for dirRow, relFP in examIndex.IterDirs():
+
+        examDirD[relFP] = dirRow
+
+    planL = []
+
+    nKept = 0
+
+    for dirRow, relFP in mainIndex.IterDirs():
+
+        if not examineL[dirRow] or relFP not in examDirD:
+
+            continue
+
+        examFileD = {}
+
+        for examRow in examIndex.DirFiles(examDirD[relFP]):
+
+            examFileD[examIndex.FileName(examRow)] = examRow
+
+        if removeDSstore and '.DS_Store' in examFileD:
+
+            planL.append( (examFileD['.DS_Store'], os.path.join(relFP,'.DS_Store'), '.DS_Store') )
+
+        for fileRow in mainIndex.DirFiles(dirRow):
+
+            name = mainIndex.FileName(fileRow)
+
+            examRow = examFileD.get(name)
+
+            if examRow is None or (removeDSstore and name == '.DS_Store'):
+
+                continue
+
+            if name[0] == '.' and not removeHidden:
+
+                continue
+
+            relFPN = os.path.join(relFP,name)
+
+            if pathFilter is not None and not pathFilter.KeepFile(name, relFPN, mainIndex.sizeA[fileRow]):
+
+                continue
+
+            reason = ManifestDuplicateDecision(mainIndex, fileRow, examIndex, examRow, relFPN, mainLive, examLive,
+                                               removeAllDupl, removeSmallerOlder, deleleExtL)
+
+            if reason:
+
+                planL.append( (examRow, relFPN, reason) )
+
+            else:
+
+                nKept += 1
+
+    return planL, nKept
+
+def ApplyDeletionPlan(planFPN):
+    """ Delete the files listed in a deletion plan, on the machine holding them
+
+        Files whose size or mtime changed since the plan was made are kept, and
+        paths that are absolute or lead outside the plan root are skipped.
+
+        :param str planFPN: plan written by ManifestMatchingPaths
+
+        :returns: number of files deleted
+        :rtype: int
+    """
+
+    rootFP = None
+
+    nDeleted = 0
+
+    with open(planFPN) as planF:
+
+        for line in planF:
+
+            fieldL = line.rstrip('\n').split('\t')
+
+            if fieldL[0] == '# root':
+
+                rootFP = os.path.realpath(fieldL[1])
+
+                if not os.path.isdir(rootFP):
+
+                    print ('Plan root missing, its files are skipped', fieldL[1])
+
+                    rootFP = None
+
+                continue
+
+            if rootFP is None or len(fieldL) != 4:
+
+                continue
+
+            reason, size, mtime, relFPN = fieldL
+
+            fileFPN = os.path.join(rootFP, relFPN)
+
+            # only files inside the root, never absolute or .. paths, nor symlinks leading out
+            if os.path.isabs(relFPN) or not os.path.realpath(fileFPN).startswith(rootFP.rstrip(os.sep) + os.sep):
+
+                print ('Path outside the plan root, skipped', relFPN)
+
+                continue
+
+            try:
+
+                st = os.stat(fileFPN)
+
+            except OSError:
+
+                continue
+
+            if st.st_size != int(size) or st.st_mtime != float(mtime):
+
+                print ('Changed since the plan was made, kept', fileFPN)
+
+                continue
+
+            if reason != '.DS_Store':
+
+                print ('Deleting %s' %(reason), fileFPN)
+
+            os.remove(fileFPN)
+
+            nDeleted += 1
+
+    return nDeleted
+
+def ManifestMatchingPaths(mainFP, examFPL, removeHidden, removeDSstore, removeAllDupl, removeRoot, removeSmallerOlder, deleleExtL, indexD={}, manifestD={}, filterD={}, ioD={}):
+    """ Remove matching paths using tree manifests, for roots on machines that are not mounted
+
+        A manifest is a fully hashed TreeIndex (relative path, size, mtime and md5 per
+        file) saved as gzipped JSON Lines, see SaveManifest. Each machine exports
+        manifests of its own roots to manifestD['exportFP'], hashing only local
+        disks. Any root in mainFP or examFPL that is a file is read as a manifest,
+        all others are live local trees. As in LoopMatchingPaths every root is main for the roots after it.
+        Duplicates in live exam trees are deleted unless manifestD['planOnly'] is set,
+        duplicates in manifests are written to manifestD['planFPN'] for ApplyDeletionPlan
+        on the machine that holds them.
+
+        :param str mainFP: root folder path or manifest for main directory to keep
+
+        :param list examFPL: root folder paths or manifests for examination directories to clean
+
+        :param dict manifestD: manifest settings (exportFP, planFPN, planOnly, applyPlanFPN)
+
+        Other parameters as for LoopMatchingPaths
+    """
+
+    if manifestD.get('applyPlanFPN'):
+
+        print ('Applied plan', manifestD['applyPlanFPN'], ApplyDeletionPlan(manifestD['applyPlanFPN']), 'files deleted')
+
+        return
+
+    pathFilter = PathFilter(filterD) if filterD else None
+
+    deleleExtL = set(deleleExtL)
+
+    indexFP = indexD.get('indexFP') if indexD.get('useIndex') else False
+
+    exportFP = manifestD.get('exportFP')
+
+    treeL = []
+
+    for rootFP in [mainFP] + list(examFPL):
+
+        if os.path.isfile(rootFP):
+
+            index = LoadManifest(rootFP)
+
+            if index is None:
+
+                sys.exit('EXITING not a tree manifest: %s' %(rootFP))
+
+            print ('Loaded manifest', rootFP, 'of', index.rootFP, len(index), 'files')
+
+            treeL.append( (index, False) )
+
+        elif os.path.isdir(rootFP):
+
+            # always walk, but reuse cached hashes from a saved index
+            treeL.append( (GetTreeIndex(rootFP, indexFP, indexD.get('rebuildIndex', False), True), True) )
+
+    if exportFP:
+
+        if not os.path.exists(exportFP):
+
+            os.makedirs(exportFP)
+
+        for index, live in treeL:
+
+            if not live:
+
+                continue
+
+            print ('    hashed', HashTreeIndex(index, ioD), 'files')
+
+            manifestFPN = ManifestFPN(exportFP, index.rootFP)
+
+            SaveManifest(index, manifestFPN)
+
+            print ('Exported manifest', manifestFPN)
+
+            if indexFP:
+
+                SaveTreeIndex(index, indexFP)
+
+    # with live trees only, this run just exports
+    if all(live for index, live in treeL):
+
+        return
+
+    planLineL = []
+
+    for i, (mainIndex, mainLive) in enumerate(treeL[0:-1]):
+
+        for examIndex, examLive in treeL[i+1:]:
+
+            print ('mainfolder', mainIndex.rootFP, '' if mainLive else '(manifest)')
+
+            print ('    examFolder', examIndex.rootFP, '' if examLive else '(manifest)')
+
+            planL, nKept = ManifestPlan(mainIndex, examIndex, mainLive, examLive, removeHidden, removeDSstore,
+                                        removeAllDupl, removeSmallerOlder, deleleExtL, pathFilter)
+
+            print ('    %s duplicates, %s bytes, %s kept' %(len(planL), sum(examIndex.sizeA[r] for r, relFPN, reason in planL), nKept))
+
+            if examLive and not manifestD.get('planOnly'):
+
+                for examRow, relFPN, reason in planL:
+
+                    examFile = os.path.join(examIndex.rootFP, relFPN)
+
+                    # the tree may have changed since it was indexed
+                    try:
+
+                        st = os.stat(examFile)
+
+                    except OSError:
+
+                        continue
+
+                    if (st.st_size, st.st_mtime) != (examIndex.sizeA[examRow], examIndex.mtimeA[examRow]):
+
+                        continue
+
+                    if reason != '.DS_Store':
+
+                        print ('Deleting %s' %(reason), examFile)
+
+                    os.remove(examFile)
+
+                RemoveEmptyFolders(examIndex.rootFP)
+
+                continue
+
+            planLineL.append('# root\t%s' %(examIndex.rootFP))
+
+            for examRow, relFPN, reason in planL:
+
+                planLineL.append('%s\t%s\t%r\t%s' %(reason, examIndex.sizeA[examRow], examIndex.mtimeA[examRow], relFPN))
+
+    if planLineL and manifestD.get('planFPN'):
+
+        with open(manifestD['planFPN'], 'w') as planF:
+
+            planF.write('\n'.join(planLineL) + '\n')
+
+        print ('Deletion plan written to', manifestD['planFPN'])
+
+    if indexFP:
+
+        # keep the hashes calculated for live trees
+        for index, live in treeL:
+
+            if live:
+
+                SaveTreeIndex(index, indexFP)
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+
+IN_CLOSE_WRITE = 0x00000008
+
+IN_MOVED_FROM = 0x00000040
+
+IN_MOVED_TO = 0x00000080
+
+IN_CREATE = 0x00000100
+
+IN_DELETE = 0x00000200
+
+IN_DELETE_SELF = 0x00000400
+
+IN_MOVE_SELF = 0x00000800
+
+IN_Q_OVERFLOW = 0x00004000
+
+IN_IGNORED = 0x00008000
+
+IN_ISDIR = 0x40000000
+
+IN_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+class InotifyWatcher:
+    """ Minimal recursive inotify watcher using libc through ctypes (Linux only)
+    """
+
+    eventHeader = struct.Struct('iIII')
+
+    def __init__(self):
+
+        if not sys.platform.startswith('linux'):
+
+            sys.exit('EXITING watch mode requires Linux inotify')
+
+        import ctypes.util
+
+        self.ctypes = ctypes
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+
+        if self.fd < 0:
+
+            errno = self.ctypes.get_errno()
+
+            raise OSError(errno, 'inotify_init1: %s' %(os.strerror(errno)))
+
+        # watch descriptor to folder path
+        self.wdD = {}
+
+    def AddWatch(self, dirFP):
+        """ Watch a folder, subfolders are not included
+
+            :param str dirFP: folder path
+
+            :returns: watch descriptor, None if the folder cannot be watched
+            :rtype: int
+        """
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirFP), IN_WATCH_MASK)
+
+        if wd < 0:
+
+            errno = self.ctypes.get_errno()
+
+            print ('Cannot watch folder', dirFP, os.strerror(errno))
+
+            return None
+
+        self.wdD[wd] = dirFP
+
+        return wd
+
+    def AddTree(self, rootFP, removeHidden=True, pathFilter=None, relFP=''):
+        """ Watch a folder and all its subfolders
+
+            :param str rootFP: root folder path
+
+            :param bool removeHidden: also watch hidden folders
+
+            :param PathFilter pathFilter: include/exclude rules, excluded folders are not watched
+
+            :param str relFP: path of rootFP relative to the watched root, if it is a subfolder
+
+            :returns: watch descriptor of rootFP, None if it cannot be watched
+            :rtype: int
+        """
+
+        rootWd = None
+
+        for root, dirs, nofiles in os.walk(rootFP, topdown=True):
+
+            if not removeHidden:
+
+                dirs[:] = [d for d in dirs if not d[0] == '.']
+
+            if pathFilter is not None:
+
+                relRoot = os.path.join(relFP, root[len(rootFP):].lstrip(os.sep)).rstrip(os.sep)
+
+                depth = relRoot.count(os.sep) + 2 if relRoot else 1
+
+                dirs[:] = [d for d in dirs if pathFilter.KeepDir(d, os.path.join(relRoot,d), depth)]
+
+            wd = self.AddWatch(root)
+
+            if root == rootFP:
+
+                rootWd = wd
+
+        return rootWd
+
+    def ReadEvents(self, timeout):
+        """ Wait for events
+
+            :param float timeout: seconds to wait
+
+            :returns: list of (mask, path) tuples, path is None for queue overflow
+            :rtype: list
+        """
+
+        readyL = select.select([self.fd], [], [], timeout)[0]
+
+        if not readyL:
+
+            return []
+
+        buf = os.read(self.fd, 1 << 16)
+
+        eventL = []
+
+        pos = 0
+
+        while pos + self.eventHeader.size <= len(buf):
+
+            wd, mask, cookie, length = self.eventHeader.unpack_from(buf, pos)
+
+            pos += self.eventHeader.size
+
+            name = os.fsdecode(buf[pos:pos+length].rstrip(b'\x00'))
+
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+
+                eventL.append( (mask, None) )
+
+                continue
+
+            dirFP = self.wdD.get(wd)
+
+            if mask & IN_IGNORED:
+
+                self.wdD.pop(wd, None)
+
+                continue
+
+            if dirFP is None:
+
+                continue
+
+            eventL.append( (mask, os.path.join(dirFP, name) if name else dirFP) )
+
+        return eventL
+
+    def Close(self):
+
+        os.close(self.fd)
+
+class LiveTreeIndex:
+    """ Updatable in-memory lookup of the files in a tree, keyed on relative folder path
+
+        :param TreeIndex index: tree index to start from
+    """
+
+    def __init__(self, index):
+
+        self.rootFP = index.rootFP
+
+        self.dirD = {}
+
+        for dirRow, relFP in index.IterDirs():
+
+            self.dirD[relFP] = set(index.FileName(r) for r in index.DirFiles(dirRow))
+
+    def Contains(self, relFP, name):
+
+        return name in self.dirD.get(relFP, ())
+
+    def HasDir(self, relFP):
+
+        return relFP in self.dirD
+
+    def Add(self, relFP, name):
+
+        self.dirD.setdefault(relFP, set()).add(sys.intern(name))
+
+    def Discard(self, relFP, name):
+
+        nameS = self.dirD.get(relFP)
+
+        if nameS is not None:
+
+            nameS.discard(name)
+
+    def DiscardDir(self, relFP):
+
+        prefix = relFP + os.sep
+
+        for key in [k for k in self.dirD if k == relFP or k.startswith(prefix)]:
+
+            del self.dirD[key]
+
+def WatchRootOf(rootL, path):
+    """ Position of the watched root holding a path and the path relative to it
+
+        :param list rootL: watched root folder paths, main first
+
+        :param str path: full path
+
+        :returns: root position and relative path, or (None, None)
+        :rtype: tuple
+    """
+
+    for pos, rootFP in enumerate(rootL):
+
+        if path.startswith(rootFP + os.sep):
+
+            return pos, path[len(rootFP)+1:]
+
+    return None, None
+
+def WatchEvaluateFile(rootL, liveL, pos, relFPN, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL, pathFilter=None):
+    """ Evaluate a created, moved or modified file against the other watched roots
+
+        Roots earlier in the list act as main for later roots, as in LoopMatchingPaths.
+
+        :param list rootL: watched root folder paths, main first
+
+        :param list liveL: LiveTreeIndex per root
+
+        :param int pos: position of the root holding the file
+
+        :param str relFPN: file path relative to its root
+
+        :param PathFilter pathFilter: include/exclude rules
+    """
+
+    relFP, name = os.path.split(relFPN)
+
+    # files directly under a root are not examined, as when walking
+    if not relFP:
+
+        return
+
+    if not removeHidden and any(part[0] == '.' for part in relFPN.split(os.sep)):
+
+        return
+
+    fileFPN = os.path.join(rootL[pos], relFPN)
+
+    if pathFilter is not None and name != '.DS_Store' and not pathFilter.KeepFilePath(relFPN, 
+                                                                                   os.path.getsize(fileFPN) if pathFilter.sizeRule else None):
+
+        return
+
+    if name == '.DS_Store':
+
+        if removeDSstore and pos > 0 and any(liveL[j].HasDir(relFP) for j in range(pos)):
+
+            print ('Removing', fileFPN)
+
+            os.remove(fileFPN)
+
+            liveL[pos].Discard(relFP, name)
+
+        return
+
+    # a new exam file is checked against all earlier roots
+    for j in range(pos):
+
+        if liveL[j].Contains(relFP, name):
+
+            mainFile = os.path.join(rootL[j], relFPN)
+
+            if os.path.isfile(mainFile) and os.path.isfile(fileFPN):
+
+                RemoveDuplicateFile(mainFile, fileFPN, removeAllDupl, removeSmallerOlder, deleleExtL)
+
+            if not os.path.isfile(fileFPN):
+
+                liveL[pos].Discard(relFP, name)
+
+                return
+
+    # a new main file can make copies in later roots duplicates
+    for j in range(pos+1, len(rootL)):
+
+        if liveL[j].Contains(relFP, name):
+
+            examFile = os.path.join(rootL[j], relFPN)
+
+            if os.path.isfile(examFile):
+
+                RemoveDuplicateFile(fileFPN, examFile, removeAllDupl, removeSmallerOlder, deleleExtL)
+
+            if not os.path.isfile(examFile):
+
+                liveL[j].Discard(relFP, name)
+
+def WatchMatchingPaths(mainFP, examFPL, removeHidden, removeDSstore, removeAllDupl, removeRoot, removeSmallerOlder, deleleExtL, indexD={}, merkleD={}, watchD={}, shardD={}, filterD={}, ioD={}):
+    """ Long-running incremental removal of matching paths driven by inotify (Linux)
+    
+        After an initial full pass, only files that are created, moved or modified
+        are evaluated against an in-memory index of all roots. Events are debounced
+        until a file has been quiet and unchanged for watchD['debounce'] seconds.
+        A full pass is repeated every watchD['rescanInterval'] seconds and when the
+        kernel event queue overflows. Emptied roots are kept, and a root that was
+        removed and recreated is watched again after the next pass. Stop with Ctrl-C.
+    
+        :param str mainFP: root folder path for main directory to keep
+        
+        :param list examFPL: root folder paths for examination directory to clean
         
-        :param bool removeAllDupl: remove file if full path is identical, disregarding md5 hash
+        :param dict watchD: watch settings (debounce, rescanInterval)
         
-        :param bool removeSmallerOlder: remove file if full path is identical and examined copy is smaller and older
-    
-        :param list deleleExtL: List of file extensions to delete; if list == ['*'] all identified copies are deleted
+        Other parameters as for LoopMatchingPaths
     """
-
     
-    loopL = [mainFP]
+    debounce = float(watchD.get('debounce', 5))
     
-    loopL.extend(examFPL)
-
-    for index, mainFolder in enumerate(loopL):
-             
-        if not os.path.isdir(mainFolder):
-            
-            continue
-
-        if index == len(loopL)-1:
-            
-            break
+    rescanInterval = float(watchD.get('rescanInterval', 86400))
+    
+    rootL = [os.path.abspath(fp) for fp in [mainFP] + list(examFPL) if os.path.isdir(fp)]
+    
+    pathFilter = PathFilter(filterD) if filterD else None
+    
+    deleleExtS = set(deleleExtL)
+    
+    watcher = InotifyWatcher()
+    
+    # Watch before the full pass, so that nothing arriving during it is missed
+    rootWdL = [watcher.AddTree(rootFP, removeHidden, pathFilter) for rootFP in rootL]
         
-        print ('mainfolder', index, mainFolder)
+    print ('Watching', len(watcher.wdD), 'folders')
+    
+    # file path to (last event time, size, mtime)
+    pendingD = {}
+    
+    liveL = None
+    
+    nextRescan = 0
+    
+    try:
         
-        for examIndex in range(index+1,len(loopL)):
+        while True:
             
-            examFolder = loopL[examIndex]
-
-            print ('    examFolder',examFolder)
+            now = time.time()
             
-            if not os.path.isdir(examFolder):
-                continue
-                                 
-            examRoot = examFolder
-        
-            RemoveMatchingPaths(mainFolder, examFolder, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtL )
+            if now >= nextRescan:
+                
+                LoopMatchingPaths(mainFP, examFPL, removeHidden, removeDSstore, removeAllDupl, removeRoot, removeSmallerOlder, deleleExtL, indexD, merkleD, shardD, filterD, ioD, True)
+                
+                liveL = [LiveTreeIndex(BuildTreeIndex(rootFP)) for rootFP in rootL]
+                
+                nextRescan = time.time() + rescanInterval
+                
+                pendingD = {}
                 
-            RemoveEmptyFolders(examRoot)
+            # a root removed from outside loses its watch (IN_IGNORED), watch it
+            # again once it is recreated and queue what arrived in it meanwhile
+            lostRoot = False
             
+            for pos, rootFP in enumerate(rootL):
+                
+                if rootWdL[pos] in watcher.wdD:
+                    
+                    continue
+                
+                if not os.path.isdir(rootFP):
+                    
+                    lostRoot = True
+                    
+                    continue
+                
+                print ('Watching recreated root', rootFP)
+                
+                rootWdL[pos] = watcher.AddTree(rootFP, removeHidden, pathFilter)
+                
+                liveL[pos] = LiveTreeIndex(BuildTreeIndex(rootFP))
+                
+                for root, dirs, files in os.walk(rootFP):
+                    
+                    for file in files:
+                        
+                        pendingD[os.path.join(root, file)] = (time.time(), -1, -1)
+                        
+            for mask, path in watcher.ReadEvents(min(debounce, 1.0) if pendingD or lostRoot else max(0, nextRescan-now)):
+                
+                if path is None:
+                    
+                    print ('inotify queue overflow, rescanning')
+                    
+                    nextRescan = 0
+                    
+                    continue
+                
+                pos, relFPN = WatchRootOf(rootL, path)
+                
+                if pos is None:
+                    
+                    continue
+                
+                relFP, name = os.path.split(relFPN)
+                
+                if mask & IN_ISDIR:
+                    
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        
+                        # watch the new folder and queue anything already in it
+                        if pathFilter is not None and not pathFilter.KeepDirPath(relFPN):
+                            
+                            continue
+                        
+                        watcher.AddTree(path, removeHidden, pathFilter, relFPN)
+                        
+                        for root, dirs, files in os.walk(path):
+                            
+                            for file in files:
+                                
+                                pendingD[os.path.join(root, file)] = (time.time(), -1, -1)
+                                
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        
+                        liveL[pos].DiscardDir(relFPN)
+                        
+                    continue
+                
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    
+                    liveL[pos].Discard(relFP, name)
+                    
+                    pendingD.pop(path, None)
+                    
+                elif mask & (IN_CREATE | IN_MOVED_TO | IN_MODIFY | IN_CLOSE_WRITE):
+                    
+                    liveL[pos].Add(relFP, name)
+                    
+                    pendingD[path] = (time.time(), -1, -1)
+                    
+            # Evaluate files that have been quiet for the debounce period and no longer change
+            now = time.time()
+            
+            for path, (lastEvent, size, mtime) in list(pendingD.items()):
+                
+                if now - lastEvent < debounce:
+                    
+                    continue
+                
+                try:
+                    
+                    st = os.stat(path)
+                    
+                except OSError:
+                    
+                    del pendingD[path]
+                    
+                    continue
+                
+                if (st.st_size, st.st_mtime) != (size, mtime):
+                    
+                    pendingD[path] = (now, st.st_size, st.st_mtime)
+                    
+                    continue
+                
+                del pendingD[path]
+                
+                pos, relFPN = WatchRootOf(rootL, path)
+                
+                if pos is not None and stat.S_ISREG(st.st_mode):
+                    
+                    WatchEvaluateFile(rootL, liveL, pos, relFPN, removeHidden, removeDSstore, removeAllDupl, removeSmallerOlder, deleleExtS, pathFilter)
+                    
+    except KeyboardInterrupt:
+        
+        print ('Stopped watching')
+        
+    finally:
+        
+        watcher.Close()
             
-def SetupProcesses(docpath, projFN):
+def SetupProcesses(docpath, projFN, jobs=0, verbose=None):
     '''Setup and loop processes
     
     :paramn docpath: path to text file 
@@ -348,6 +3365,12 @@ def SetupProcesses(docpath, projFN):
             
     :param projFN: project filename
     :rtype: str
+    
+    :param jobs: if given, overrides the sharded scan: >1 processes, 1 a single process
+    :type jobs: int
+    
+    :param verbose: if given, overrides the verbose parameter; >1 reports the time taken for each json file
+    :type verbose: int
                 
     '''
     
@@ -387,6 +3410,57 @@ def SetupProcesses(docpath, projFN):
         print ('jsonObj:', jsonObj)
         
         paramD = ReadRemoveMatchingPathsJson(jsonObj)
+        
+        if verbose is not None:
+            
+            paramD['verbose'] = verbose
+            
+        if jobs:
+            
+            paramD.setdefault('shard', {})
+            
+            paramD['shard']['useShard'] = jobs > 1
+            
+            paramD['shard']['processes'] = jobs
+
+        if paramD.get('manifest', {}).get('useManifest'):
+            
+            ManifestMatchingPaths(paramD['mainFP'], 
+                                  paramD['examFPL'], 
+                                  paramD['remove']['removeHidden'], 
+                                  paramD['remove']['removeDSstore'], 
+                                  paramD['remove']['removeAllDupl'], 
+                                  paramD['remove']['removeRoot'], 
+                                  paramD['remove']['removeSmallerOlder'], 
+                                  paramD['deleleExtL'],
+                                  paramD.get('index', {}),
+                                  paramD['manifest'],
+                                  paramD.get('filter', {}),
+                                  paramD.get('io', {}))
+            
+            continue
+
+        if paramD.get('watch', {}).get('useWatch'):
+            
+            # Blocks until interrupted, the full pass is included
+            WatchMatchingPaths(paramD['mainFP'], 
+                               paramD['examFPL'], 
+                               paramD['remove']['removeHidden'], 
+                               paramD['remove']['removeDSstore'], 
+                               paramD['remove']['removeAllDupl'], 
+                               paramD['remove']['removeRoot'], 
+                               paramD['remove']['removeSmallerOlder'], 
+                               paramD['deleleExtL'],
+                               paramD.get('index', {}),
+                               paramD.get('merkle', {}),
+                               paramD['watch'],
+                               paramD.get('shard', {}),
+                               paramD.get('filter', {}),
+                               paramD.get('io', {}))
+            
+            continue
+        
+        t0 = time.time()
 
         LoopMatchingPaths(paramD['mainFP'], 
                           paramD['examFPL'], 
@@ -395,15 +3469,123 @@ def SetupProcesses(docpath, projFN):
                           paramD['remove']['removeAllDupl'], 
                           paramD['remove']['removeRoot'], 
                           paramD['remove']['removeSmallerOlder'], 
-                          paramD['deleleExtL'])
+                          paramD['deleleExtL'],
+                          paramD.get('index', {}),
+                          paramD.get('merkle', {}),
+                          paramD.get('shard', {}),
+                          paramD.get('filter', {}),
+                          paramD.get('io', {}))
+        
+        if paramD.get('verbose', 1) > 1:
+            
+            print ('    %s done in %.1f s' %(os.path.basename(jsonObj), time.time()-t0))
+
+def ProfileRun(profileFPN, traceMemoryFPN, func, *argL):
+    """ Run a function, optionally under cProfile and/or tracemalloc, and dump the results
+    
+        :param str profileFPN: path for cProfile stats, False for no profiling
+        
+        :param str traceMemoryFPN: path for the tracemalloc snapshot, False for no tracing
+        
+        :param func: function to run with argL
+    """
+    
+    if traceMemoryFPN:
+        
+        import tracemalloc
+        
+        tracemalloc.start(25)
+        
+    try:
+        
+        if profileFPN:
+            
+            import cProfile, pstats
+            
+            profiler = cProfile.Profile()
+            
+            try:
+                
+                profiler.runcall(func, *argL)
+                
+            finally:
+                
+                profiler.dump_stats(profileFPN)
+                
+                print ('cProfile stats written to', profileFPN)
+                
+                pstats.Stats(profiler, stream = sys.stderr).sort_stats('cumulative').print_stats(30)
+                
+        else:
+            
+            func(*argL)
+            
+    finally:
+        
+        if traceMemoryFPN:
+            
+            snapshot = tracemalloc.take_snapshot()
+            
+            current, peak = tracemalloc.get_traced_memory()
+            
+            tracemalloc.stop()
+            
+            snapshot.dump(traceMemoryFPN)
+            
+            print ('tracemalloc snapshot written to %s, peak %.1f MB' %(traceMemoryFPN, peak/1024**2), file = sys.stderr)
+            
+            for statistic in snapshot.statistics('lineno')[0:20]:
+                
+                print ('    ', statistic, file = sys.stderr)
+
+def main(argv=None):
+    """ Command line entry point
+    
+        :param list argv: arguments, default sys.argv[1:]
+    """
+    
+    parser = argparse.ArgumentParser(description = 'Remove files in examination folders that duplicate files at matching paths in a main folder')
+    
+    parser.add_argument('projFPN', help = 'project text file listing json parameter files')
+    
+    parser.add_argument('-j', '--jobs', type = int, default = 0, 
+                        help = 'processes for a sharded scan, 1 for a single process (default: as in the json files)')
+    
+    parser.add_argument('-v', '--verbose', action = 'count', default = 1, 
+                        help = 'also report the time taken for each json file (default: verbose in the json files)')
+    
+    parser.add_argument('-q', '--quiet', action = 'store_true', help = 'no progress output on stdout, errors are still shown')
+    
+    parser.add_argument('--profile', metavar = 'FILE', default = False, 
+                        help = 'run under cProfile, dump stats to FILE and print the top functions (main process only)')
+    
+    parser.add_argument('--trace-memory', metavar = 'FILE', default = False, 
+                        help = 'trace allocations with tracemalloc, dump the snapshot to FILE and print the top lines')
+    
+    parser.add_argument('--template', action = 'store_true', 
+                        help = 'write a template json parameter file next to the project file and exit')
+    
+    args = parser.parse_args(argv)
+    
+    docpath, projFN = os.path.split(os.path.abspath(args.projFPN))
+    
+    if args.template:
+        
+        CreateParamJson(docpath)
+        
+        return
+    
+    # the json verbose parameter holds unless -v or -q is given
+    verbose = 0 if args.quiet else (args.verbose if args.verbose > 1 else None)
+    
+    with open(os.devnull, 'w') as devnullF:
+        
+        with contextlib.redirect_stdout(devnullF if args.quiet else sys.stdout):
+            
+            ProfileRun(args.profile, args.trace_memory, SetupProcesses, docpath, projFN, args.jobs, verbose)
                              
 if __name__ == "__main__":
     """ If script is run as stand alone
     """
     
-    docpath = '/Users/thomasgumbricht/GitHub'
-    
-    projFN = 'remove_matching_paths.txt'
-    
-    SetupProcesses(docpath, projFN)
-        
\ No newline at end of file
+    main()